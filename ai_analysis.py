@@ -2,10 +2,153 @@
 AI-powered CAD analysis using OpenRouter
 Authors: Josh Ayokhai & River
 """
-import httpx
+import asyncio
+import copy
+import hashlib
 import json
+import time
+from collections import OrderedDict
 from typing import Dict, Any, List
 
+from app.ai_dispatcher import ai_dispatcher
+from app.metrics import CACHE_REQUESTS
+from app.prompt_context import estimate_tokens, file_context, prompt_size
+from app.config import (
+    AI_TIMEOUT,
+    AI_PROMPT_TOKEN_BUDGET,
+    AI_BOM_PROMPT_TOKEN_BUDGET,
+    AI_CACHE_ENABLED,
+    AI_CACHE_TTL,
+    AI_CACHE_MAX_ENTRIES,
+    OPENROUTER_BASE_URL
+)
+
+OPENROUTER_CHAT_URL = f"{OPENROUTER_BASE_URL}/chat/completions"
+
+# A file summary always gets at least this many tokens, even over the budget
+MIN_CONTEXT_TOKENS = 64
+
+
+class InvalidAIResponse(ValueError):
+    """The model answered, but not with a parseable JSON object"""
+
+    def __init__(self, raw_response, message="AI response was not valid JSON"):
+        super().__init__(message)
+        self.raw_response = raw_response
+
+
+class AIResultCache:
+    """
+    In-memory TTL/LRU cache of parsed AI responses.
+    Concurrent requests for the same key share a single upstream call.
+    """
+
+    def __init__(self, ttl, max_entries, enabled=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled and max_entries > 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    @staticmethod
+    def key(model, prompt):
+        """Hash of the model and the prompt with whitespace normalized"""
+        normalized = " ".join(prompt.split())
+        return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_call(self, key, call):
+        """Return the cached value for key, joining or starting the upstream call on a miss"""
+        if not self.enabled:
+            return await call()
+
+        value = self.get(key)
+        if value is not None:
+            CACHE_REQUESTS.inc(cache="ai", result="hit")
+            return copy.deepcopy(value)
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            CACHE_REQUESTS.inc(cache="ai", result="coalesced")
+        else:
+            CACHE_REQUESTS.inc(cache="ai", result="miss")
+            task = asyncio.ensure_future(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        # Shielded, so one caller going away doesn't cancel the call for the others
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _finish(self, key, task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+
+ai_cache = AIResultCache(AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES, AI_CACHE_ENABLED)
+
+
+async def _request_completion(prompt, api_key, model, site_url, timeout):
+    """Send one prompt to OpenRouter and parse the JSON object in its answer"""
+    response = await ai_dispatcher.post(
+        OPENROUTER_CHAT_URL,
+        api_key,
+        timeout=timeout,
+        headers={
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": site_url,
+            "X-Title": "CAD Converter"
+        },
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+    )
+    result = response.json()
+    
+    ai_content = result['choices'][0]['message']['content']
+    
+    # Parse JSON response
+    ai_content = ai_content.strip()
+    if ai_content.startswith('```'):
+        ai_content = ai_content.split('```')[1]
+        if ai_content.startswith('json'):
+            ai_content = ai_content[4:]
+    ai_content = ai_content.strip()
+    
+    try:
+        parsed = json.loads(ai_content)
+    except json.JSONDecodeError:
+        raise InvalidAIResponse(ai_content)
+    if not isinstance(parsed, dict):
+        raise InvalidAIResponse(ai_content, "AI response was not a JSON object")
+    return parsed
+
+
+async def _cached_completion(prompt, api_key, model, site_url, timeout):
+    """Completion for a prompt, served from the AI cache when the same prompt was seen before"""
+    return await ai_cache.get_or_call(
+        AIResultCache.key(model, prompt),
+        lambda: _request_completion(prompt, api_key, model, site_url, timeout)
+    )
+
 
 async def analyze_file_with_ai(
     file_data: Dict[str, Any],
@@ -17,7 +160,7 @@ async def analyze_file_with_ai(
     Use OpenRouter AI to analyze CAD file and extract structured data
     
     Args:
-        file_data: Dictionary with filename, file_type, metadata, dimensions, step_content
+        file_data: Dictionary with filename, file_type, metadata, dimensions, step_summary
         api_key: OpenRouter API key
         model: OpenRouter model identifier
         site_url: Your site URL for OpenRouter attribution
@@ -30,18 +173,10 @@ async def analyze_file_with_ai(
 File name: {file_data.get('filename', 'unknown')}
 File type: {file_data.get('file_type', 'unknown')}
 
-Extracted metadata:
-{json.dumps(file_data.get('metadata', {}), indent=2)}
-
-Physical dimensions:
-{json.dumps(file_data.get('dimensions', {}), indent=2)}
-
+File summary:
 """
     
-    if file_data.get('step_content'):
-        prompt += f"\nSTEP file header content:\n```\n{file_data['step_content'][:3000]}\n```\n"
-    
-    prompt += """
+    instructions = """
 Please provide a structured JSON response with the following fields:
 {
   "part_name": "Best guess for part name",
@@ -64,47 +199,27 @@ Make reasonable inferences based on:
 
 Return ONLY valid JSON, no additional text.
 """
-    
-    messages = [{"role": "user", "content": prompt}]
+    # The file summary gets whatever the rest of the prompt leaves of the budget
+    context_tokens = max(
+        AI_PROMPT_TOKEN_BUDGET - estimate_tokens(prompt + instructions),
+        MIN_CONTEXT_TOKENS
+    )
+    prompt += file_context(file_data, context_tokens) + "\n" + instructions
+    size = prompt_size(prompt, AI_PROMPT_TOKEN_BUDGET)
     
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": site_url,
-                    "X-Title": "CAD Converter"
-                },
-                json={
-                    "model": model,
-                    "messages": messages
-                }
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            ai_content = result['choices'][0]['message']['content']
-            
-            # Parse JSON response
-            ai_content = ai_content.strip()
-            if ai_content.startswith('```'):
-                ai_content = ai_content.split('```')[1]
-                if ai_content.startswith('json'):
-                    ai_content = ai_content[4:]
-            ai_content = ai_content.strip()
-            
-            structured_data = json.loads(ai_content)
-            return structured_data
-            
-    except json.JSONDecodeError:
-        return {
-            "error": "AI response was not valid JSON",
-            "raw_response": ai_content
+        result = await _cached_completion(prompt, api_key, model, site_url, timeout=AI_TIMEOUT)
+    
+    except InvalidAIResponse as e:
+        result = {
+            "error": str(e),
+            "raw_response": e.raw_response
         }
     except Exception as e:
-        return {"error": f"AI analysis failed: {str(e)}"}
+        result = {"error": f"AI analysis failed: {str(e)}"}
+
+    result["prompt_size"] = size
+    return result
 
 
 async def generate_bom_from_batch(
@@ -130,13 +245,7 @@ async def generate_bom_from_batch(
 Files analyzed:
 """
     
-    for i, file_data in enumerate(files_data, 1):
-        prompt += f"\n{i}. {file_data.get('filename', f'File {i}')}\n"
-        prompt += f"   Type: {file_data.get('file_type', 'unknown')}\n"
-        prompt += f"   Dimensions: {file_data.get('dimensions', {})}\n"
-        prompt += f"   Metadata: {file_data.get('metadata', {})}\n"
-    
-    prompt += """
+    instructions = """
 
 Generate a complete BOM in JSON format with the following structure:
 {
@@ -171,37 +280,30 @@ Rules:
 
 Return ONLY valid JSON.
 """
+
+    headers = [
+        f"\n{i}. {file_data.get('filename', f'File {i}')}\n"
+        f"Type: {file_data.get('file_type', 'unknown')}\n"
+        f"Quantity: {file_data.get('quantity', 1)}\n"
+        + (f"Same part in: {', '.join(file_data['same_part_files'])}\n" if file_data.get("same_part_files") else "")
+        for i, file_data in enumerate(files_data, 1)
+    ]
+    # Each file summary gets an equal share of what the rest of the prompt leaves of the budget
+    fixed_tokens = estimate_tokens(prompt + instructions + "".join(headers))
+    file_tokens = max((AI_BOM_PROMPT_TOKEN_BUDGET - fixed_tokens) // len(files_data), MIN_CONTEXT_TOKENS)
+    for header, file_data in zip(headers, files_data):
+        prompt += header
+        context = file_context(file_data, file_tokens)
+        if context:
+            prompt += context + "\n"
+    prompt += instructions
+    size = prompt_size(prompt, AI_BOM_PROMPT_TOKEN_BUDGET)
     
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": site_url,
-                    "X-Title": "CAD Converter"
-                },
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": prompt}]
-                }
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            ai_content = result['choices'][0]['message']['content']
-            
-            # Parse JSON
-            ai_content = ai_content.strip()
-            if ai_content.startswith('```'):
-                ai_content = ai_content.split('```')[1]
-                if ai_content.startswith('json'):
-                    ai_content = ai_content[4:]
-            ai_content = ai_content.strip()
-            
-            bom_data = json.loads(ai_content)
-            return bom_data
+        result = await _cached_completion(prompt, api_key, model, site_url, timeout=AI_TIMEOUT)
             
     except Exception as e:
-        return {"error": f"BOM generation failed: {str(e)}"}
+        result = {"error": f"BOM generation failed: {str(e)}"}
+
+    result["prompt_size"] = size
+    return result
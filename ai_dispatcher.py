@@ -0,0 +1,147 @@
+"""
+Rate-limited, retrying dispatcher for OpenRouter requests
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app.http_clients import get_ai_client
+from app.metrics import stage_timer
+from app.config import (
+    AI_TIMEOUT,
+    AI_MAX_CONCURRENCY,
+    AI_RATE_LIMIT_PER_MINUTE,
+    AI_RATE_LIMIT_BURST,
+    AI_MAX_RETRIES,
+    AI_RETRY_BASE_DELAY,
+    AI_RETRY_MAX_DELAY
+)
+
+# Status codes worth retrying: rate limited, or a transient upstream failure
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Rate limiters for this many API keys are kept; the least recently used are dropped
+_MAX_TRACKED_KEYS = 1024
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after(response):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), if any"""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AIDispatcher:
+    """
+    Sends AI requests with a global concurrency limit, a token-bucket rate limit
+    per API key, and retries with jittered exponential backoff that honour Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=AI_MAX_CONCURRENCY,
+        rate_per_minute=AI_RATE_LIMIT_PER_MINUTE,
+        burst=AI_RATE_LIMIT_BURST,
+        max_retries=AI_MAX_RETRIES,
+        base_delay=AI_RETRY_BASE_DELAY,
+        max_delay=AI_RETRY_MAX_DELAY
+    ):
+        self.max_concurrency = max_concurrency
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = None
+        self._buckets = OrderedDict()
+
+    def _bucket(self, api_key):
+        if self.rate_per_minute <= 0:
+            return None
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate_per_minute / 60.0, self.burst)
+            self._buckets[key] = bucket
+            while len(self._buckets) > _MAX_TRACKED_KEYS:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def post(self, url, api_key, timeout=AI_TIMEOUT, **kwargs):
+        """POST to the AI endpoint, retrying transient failures; raises once retries run out"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        bucket = self._bucket(api_key)
+        client = get_ai_client()
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                await bucket.acquire()
+
+            delay = None
+            async with self._semaphore:
+                try:
+                    # One OpenRouter round trip per attempt
+                    with stage_timer("openrouter") as round_trip:
+                        response = await client.post(url, timeout=timeout, **kwargs)
+                        if response.is_error:
+                            round_trip.fail()
+                except (httpx.TimeoutException, httpx.TransportError):
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                        response.raise_for_status()
+                        return response
+                    delay = _retry_after(response)
+
+            # Wait outside the semaphore so other requests can use the slot
+            if delay is None:
+                delay = self._backoff(attempt)
+            await asyncio.sleep(min(delay, timeout))
+            attempt += 1
+
+
+ai_dispatcher = AIDispatcher()
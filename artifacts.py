@@ -0,0 +1,277 @@
+"""
+Content-addressed store for converted meshes, served by URL
+Authors: Josh Ayokhai & River
+"""
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from app.config import ARTIFACT_DIR, ARTIFACT_TTL, ARTIFACT_GC_INTERVAL
+
+# Public path artifacts are served under
+ARTIFACT_ROUTE = "/api/artifacts"
+
+CONTENT_TYPES = {
+    "glb": "model/gltf-binary",
+    "gltf": "model/gltf+json"
+}
+
+# Precompressed copies are kept only when they save at least this fraction
+_MIN_COMPRESSION_SAVING = 0.05
+
+_NAME = re.compile(r"^([0-9a-f]{64})\.(glb|gltf)$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_CHUNK_SIZE = 64 * 1024
+
+
+def _brotli():
+    """Brotli compression needs the optional Brotli package"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _compressors():
+    compressors = [("gzip", ".gz", lambda data: gzip.compress(data, compresslevel=6))]
+    brotli = _brotli()
+    if brotli is not None:
+        # Quality 5 compresses GLB/glTF close to gzip -9 speeds, smaller than gzip
+        compressors.insert(0, ("br", ".br", lambda data: brotli.compress(data, quality=5)))
+    return compressors
+
+
+class ArtifactStore:
+    """
+    Files named by the SHA-256 of their contents, with gzip (and brotli, if
+    installed) copies written alongside. A file's mtime is refreshed whenever
+    it is produced again; files untouched for ttl seconds are deleted by a
+    sweep that runs at most every gc_interval seconds, from put().
+    Safe to use from several processes: files are written once, atomically.
+    """
+
+    def __init__(self, directory, ttl, gc_interval=ARTIFACT_GC_INTERVAL):
+        self.directory = directory
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self._created = False
+
+    def path(self, name):
+        """Path of a stored artifact, or None if name is not a valid artifact name"""
+        if not _NAME.match(name):
+            return None
+        return os.path.join(self.directory, name)
+
+    def _write(self, path, data):
+        # Write to a temp file first so readers never see a partial artifact
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put(self, data, extension):
+        """
+        Store bytes as an artifact with the given extension ("glb" or "gltf").
+        Returns a reference: name, url, size, strong etag and content type.
+        """
+        if not self._created:
+            os.makedirs(self.directory, exist_ok=True)
+            self._created = True
+
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"{digest}.{extension}"
+        path = self.path(name)
+        if not self.refresh([name]):
+            self._write(path, data)
+            for _, suffix, compress in _compressors():
+                compressed = compress(data)
+                if len(compressed) <= len(data) * (1 - _MIN_COMPRESSION_SAVING):
+                    self._write(path + suffix, compressed)
+
+        self._collect_if_due()
+        return {
+            "name": name,
+            "url": f"{ARTIFACT_ROUTE}/{name}",
+            "size": len(data),
+            "etag": f'"{digest}"',
+            "contentType": CONTENT_TYPES[extension]
+        }
+
+    def refresh(self, names):
+        """Mark artifacts as used so they outlive the TTL; False if any is missing"""
+        for name in names:
+            path = self.path(name)
+            if path is None:
+                return False
+            try:
+                os.utime(path)
+            except OSError:
+                return False
+            for _, suffix, _ in _compressors():
+                try:
+                    os.utime(path + suffix)
+                except OSError:
+                    pass
+        return True
+
+    def _collect_if_due(self):
+        now = time.monotonic()
+        if now - self._last_gc >= self.gc_interval:
+            self._last_gc = now
+            self.collect()
+
+    def collect(self):
+        """Delete artifacts (and stale temp files) not touched for ttl seconds"""
+        cutoff = time.time() - self.ttl
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+artifact_store = ArtifactStore(ARTIFACT_DIR, ARTIFACT_TTL)
+
+
+def _etag_matches(header, etags):
+    """Whether If-None-Match names any of etags; weak comparison, so W/ prefixes are ignored"""
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") in etags for candidate in header.split(","))
+
+
+def _accepted_encodings(header):
+    """Content codings the client accepts (q > 0)"""
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _byte_range(header, size):
+    """
+    The (start, end) inclusive byte range of a single-range Range header.
+    None if the header should be ignored (malformed or several ranges);
+    raises ValueError if the range can't be satisfied.
+    """
+    match = _RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range outside the file")
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def artifact_response(request, name, store=artifact_store):
+    """
+    Serve an artifact: strong ETag and conditional GET, single byte ranges,
+    and the precompressed br/gzip copy when the client accepts it (ranges are
+    always served from the uncompressed file). Returns None if there is no such artifact.
+    """
+    path = store.path(name)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    digest, extension = _NAME.match(name).groups()
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"public, max-age={store.ttl}, immutable",
+        "Vary": "Accept-Encoding"
+    }
+    media_type = CONTENT_TYPES[extension]
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() != f'"{digest}"':
+        range_header = None
+
+    # Each encoding is a different representation, with its own strong ETag
+    encoding = None
+    if not range_header:
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        for coding, suffix, _ in _compressors():
+            if coding in accepted and os.path.exists(path + suffix):
+                encoding = coding
+                path += suffix
+                stat = os.stat(path)
+                break
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    headers["ETag"] = etag
+
+    # The ETag in the artifact reference is the digest alone; it validates every
+    # encoding, since they all decode to the same content-addressed bytes
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, {etag, f'"{digest}"'}):
+        return Response(status_code=304, headers=headers)
+
+    if range_header:
+        try:
+            byte_range = _byte_range(range_header, stat.st_size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{stat.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            if request.method == "HEAD":
+                return Response(status_code=206, headers=headers, media_type=media_type)
+            return StreamingResponse(
+                _read_range(path, start, end), status_code=206, headers=headers, media_type=media_type
+            )
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    # FileResponse streams from disk (zero-copy where the server supports it)
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat, method=request.method)
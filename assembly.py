@@ -0,0 +1,204 @@
+"""
+Assembly-aware STEP conversion: one mesh per unique part, instanced in a glTF node tree
+Authors: Josh Ayokhai & River
+
+Like converter.py, OCP and trimesh are imported inside the functions that use them.
+"""
+from collections import namedtuple
+
+# A node of the assembly tree. part is the index of the unique part drawn at
+# this node (None for sub-assemblies); matrix is the 4x4 transform to the parent.
+AssemblyNode = namedtuple("AssemblyNode", ["name", "matrix", "part", "children"])
+
+# A unique part: its shape without placement, and its name
+Part = namedtuple("Part", ["name", "shape"])
+
+# Sub-assemblies nested deeper than this are cut off (guards against cyclic files)
+_MAX_DEPTH = 64
+
+
+def _label_name(label):
+    from OCP.TDataStd import TDataStd_Name
+    from OCP.TCollection import TCollection_AsciiString
+
+    attribute = TDataStd_Name()
+    if label.FindAttribute(TDataStd_Name.GetID_s(), attribute):
+        return TCollection_AsciiString(attribute.Get()).ToCString()
+    return None
+
+
+def _label_entry(label):
+    """A label's entry ("0:1:1:3"), unique within the document"""
+    from OCP.TDF import TDF_Tool
+    from OCP.TCollection import TCollection_AsciiString
+
+    entry = TCollection_AsciiString()
+    TDF_Tool.Entry_s(label, entry)
+    return entry.ToCString()
+
+
+def _location_matrix(location):
+    transform = location.Transformation()
+    return [
+        [transform.Value(row, column) for column in range(1, 5)]
+        for row in range(1, 4)
+    ] + [[0.0, 0.0, 0.0, 1.0]]
+
+
+def read_step_assembly(input_path):
+    """
+    Read a STEP file with its product structure.
+    Returns the unique parts and the root AssemblyNode. A part used many times
+    (e.g. 200 identical bolts) appears once in parts and once per use in the tree.
+    """
+    from OCP.STEPCAFControl import STEPCAFControl_Reader
+    from OCP.TDocStd import TDocStd_Document
+    from OCP.TCollection import TCollection_ExtendedString
+    from OCP.XCAFDoc import XCAFDoc_DocumentTool, XCAFDoc_ShapeTool
+    from OCP.TDF import TDF_Label, TDF_LabelSequence
+    from OCP.IFSelect import IFSelect_RetDone
+
+    document = TDocStd_Document(TCollection_ExtendedString("XmlOcaf"))
+    reader = STEPCAFControl_Reader()
+    reader.SetNameMode(True)
+    if reader.ReadFile(input_path) != IFSelect_RetDone or not reader.Transfer(document):
+        raise ValueError("Could not read STEP file")
+
+    shape_tool = XCAFDoc_DocumentTool.ShapeTool_s(document.Main())
+    parts = []
+    part_index = {}
+
+    def identity():
+        return [[1.0 if row == column else 0.0 for column in range(4)] for row in range(4)]
+
+    def walk(label, depth):
+        name = _label_name(label)
+        matrix = identity()
+        content = label
+        if XCAFDoc_ShapeTool.IsReference_s(label):
+            content = TDF_Label()
+            XCAFDoc_ShapeTool.GetReferredShape_s(label, content)
+            matrix = _location_matrix(XCAFDoc_ShapeTool.GetLocation_s(label))
+            name = name or _label_name(content)
+
+        if XCAFDoc_ShapeTool.IsAssembly_s(content):
+            children = []
+            if depth < _MAX_DEPTH:
+                components = TDF_LabelSequence()
+                XCAFDoc_ShapeTool.GetComponents_s(content, components, False)
+                children = [walk(components.Value(i), depth + 1) for i in range(1, components.Length() + 1)]
+            return AssemblyNode(name or _label_name(content), matrix, None, children)
+
+        entry = _label_entry(content)
+        if entry not in part_index:
+            part_index[entry] = len(parts)
+            parts.append(Part(_label_name(content) or name, XCAFDoc_ShapeTool.GetShape_s(content)))
+        return AssemblyNode(name, matrix, part_index[entry], [])
+
+    free_shapes = TDF_LabelSequence()
+    shape_tool.GetFreeShapes(free_shapes)
+    roots = [walk(free_shapes.Value(i), 0) for i in range(1, free_shapes.Length() + 1)]
+    if len(roots) == 1:
+        return parts, roots[0]
+    return parts, AssemblyNode("root", identity(), None, roots)
+
+
+def _triangulated_mesh(shape):
+    """Mesh of a shape's existing face triangulations (see tessellate_parts)"""
+    import numpy as np
+    import trimesh
+    from OCP.TopExp import TopExp_Explorer
+    from OCP.TopAbs import TopAbs_FACE, TopAbs_REVERSED
+    from OCP.TopoDS import TopoDS
+    from OCP.TopLoc import TopLoc_Location
+    from OCP.BRep import BRep_Tool
+
+    vertices = []
+    triangles = []
+    offset = 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        face = TopoDS.Face_s(explorer.Current())
+        location = TopLoc_Location()
+        triangulation = BRep_Tool.Triangulation_s(face, location)
+        if triangulation is not None:
+            transform = location.Transformation()
+            reverse = face.Orientation() == TopAbs_REVERSED
+            for i in range(1, triangulation.NbNodes() + 1):
+                vertices.append(triangulation.Node(i).Transformed(transform).Coord())
+            for i in range(1, triangulation.NbTriangles() + 1):
+                a, b, c = triangulation.Triangle(i).Get()
+                if reverse:
+                    b, c = c, b
+                triangles.append((offset + a - 1, offset + b - 1, offset + c - 1))
+            offset += triangulation.NbNodes()
+        explorer.Next()
+
+    return trimesh.Trimesh(
+        vertices=np.array(vertices, dtype=np.float64).reshape(-1, 3),
+        faces=np.array(triangles, dtype=np.int64).reshape(-1, 3)
+    )
+
+
+def tessellate_parts(parts, linear_deflection=0.1, angular_deflection=0.1):
+    """
+    Tessellate each unique part once. All parts are meshed in a single
+    BRepMesh pass over a compound with OCC's parallel mode on, so faces are
+    spread across cores; each part's mesh is then read back from its faces.
+    """
+    from OCP.BRep import BRep_Builder
+    from OCP.BRepMesh import BRepMesh_IncrementalMesh
+    from OCP.TopoDS import TopoDS_Compound
+
+    compound = TopoDS_Compound()
+    builder = BRep_Builder()
+    builder.MakeCompound(compound)
+    for part in parts:
+        builder.Add(compound, part.shape)
+    BRepMesh_IncrementalMesh(compound, linear_deflection, True, angular_deflection, True)
+
+    return [_triangulated_mesh(part.shape) for part in parts]
+
+
+def build_scene(root, parts, meshes):
+    """
+    A trimesh Scene with the assembly's node tree. Each part's geometry is
+    added once and every use of it is a node referencing that geometry, which
+    the glTF exporter writes as one mesh shared by many nodes.
+    Returns the scene and the number of instances of each part.
+    """
+    import numpy as np
+    import trimesh
+
+    scene = trimesh.Scene()
+    geometry_names = []
+    for index, mesh in enumerate(meshes):
+        # Stored directly: add_geometry would also place an instance at the origin
+        geometry_names.append(f"part{index}")
+        scene.geometry[geometry_names[-1]] = mesh
+    instances = [0] * len(parts)
+    used_names = {scene.graph.base_frame}
+    name_counts = {}
+
+    def node_name(name):
+        """Node names must be unique; repeated names get a _2, _3... suffix"""
+        base = name or "node"
+        unique = base
+        while unique in used_names:
+            name_counts[base] = name_counts.get(base, 1) + 1
+            unique = f"{base}_{name_counts[base]}"
+        used_names.add(unique)
+        return unique
+
+    def add(node, parent):
+        name = node_name(node.name)
+        kwargs = {}
+        if node.part is not None:
+            kwargs["geometry"] = geometry_names[node.part]
+            instances[node.part] += 1
+        scene.graph.update(frame_from=parent, frame_to=name, matrix=np.array(node.matrix), **kwargs)
+        for child in node.children:
+            add(child, name)
+
+    add(root, scene.graph.base_frame)
+    return scene, instances
@@ -0,0 +1,4 @@
+"""
+Benchmark suite for the conversion pipeline and API
+Authors: Josh Ayokhai & River
+"""
@@ -0,0 +1,139 @@
+"""
+Deterministic synthetic CAD corpus for benchmarks
+Authors: Josh Ayokhai & River
+"""
+import json
+import os
+
+import cadquery as cq
+
+# Bump when the corpus geometry changes, so results from different corpora aren't compared
+CORPUS_VERSION = 1
+
+
+def _box():
+    return cq.Workplane("XY").box(40, 30, 20)
+
+
+def _cylinder():
+    return cq.Workplane("XY").cylinder(50, 15)
+
+
+def _filleted_block():
+    return (
+        cq.Workplane("XY")
+        .box(80, 60, 25)
+        .edges("|Z").fillet(8)
+        .faces(">Z").workplane()
+        .rarray(40, 30, 2, 2).hole(8)
+        .edges(">Z").fillet(2)
+    )
+
+
+def _bracket():
+    return (
+        cq.Workplane("XY")
+        .box(120, 40, 8)
+        .faces(">Z").workplane().center(-50, 0)
+        .rect(8, 40).extrude(60)
+        .edges("|Y").fillet(3)
+        .faces(">X").workplane()
+        .rarray(20, 15, 3, 2).hole(5)
+        .faces("<Z").workplane()
+        .rarray(25, 20, 4, 1).cboreHole(6, 10, 3)
+    )
+
+
+def _fastener():
+    """Hex-headed pin with a chamfered tip"""
+    head = cq.Workplane("XY").polygon(6, 10).extrude(4)
+    shank = cq.Workplane("XY").workplane(offset=4).circle(3).extrude(20).faces(">Z").chamfer(0.8)
+    return head.union(shank)
+
+
+def _grid_assembly(count):
+    """
+    An assembly of `count` bodies: a base plate with a grid of brackets and
+    fasteners. Parts repeat, so the STEP file has shared product definitions.
+    """
+    side = max(1, int(round(count ** 0.5)))
+    spacing = 140
+    plate = cq.Workplane("XY").box(side * spacing, side * spacing, 10)
+
+    assembly = cq.Assembly(name=f"grid_{count}")
+    assembly.add(plate, name="plate", color=cq.Color("gray"))
+
+    bracket = _bracket()
+    fastener = _fastener()
+    placed = 1
+    for i in range(side):
+        for j in range(side):
+            if placed >= count:
+                break
+            x = (i - (side - 1) / 2) * spacing
+            y = (j - (side - 1) / 2) * spacing
+            assembly.add(bracket, name=f"bracket_{i}_{j}", loc=cq.Location(cq.Vector(x, y, 5)))
+            placed += 1
+            if placed < count:
+                assembly.add(fastener, name=f"fastener_{i}_{j}", loc=cq.Location(cq.Vector(x + 40, y, 13)))
+                placed += 1
+    return assembly
+
+
+# name -> (category, builder); ordered by increasing complexity
+SHAPES = {
+    "box": ("primitive", _box),
+    "cylinder": ("primitive", _cylinder),
+    "filleted_block": ("filleted", _filleted_block),
+    "bracket": ("filleted", _bracket),
+    "assembly_16": ("assembly", lambda: _grid_assembly(16)),
+    "assembly_64": ("assembly", lambda: _grid_assembly(64)),
+    "assembly_256": ("assembly", lambda: _grid_assembly(256)),
+}
+
+
+def _export(shape, path):
+    if isinstance(shape, cq.Assembly):
+        if path.endswith(".stl"):
+            cq.exporters.export(shape.toCompound(), path)
+        else:
+            shape.save(path)
+    else:
+        cq.exporters.export(shape, path)
+
+
+def build_corpus(directory, names=None):
+    """
+    Write a STEP and an STL file for each corpus shape into directory and return
+    a manifest {name: {category, step, stl, sizes}}. Files are only rebuilt when
+    missing or when the corpus version changed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.json")
+
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            stored = json.load(f)
+        if stored.get("version") == CORPUS_VERSION:
+            manifest = stored["files"]
+
+    for name, (category, builder) in SHAPES.items():
+        if names and name not in names:
+            continue
+        paths = {ext: os.path.join(directory, f"{name}.{ext}") for ext in ("step", "stl")}
+        if name not in manifest or not all(os.path.exists(p) for p in paths.values()):
+            shape = builder()
+            for path in paths.values():
+                _export(shape, path)
+        manifest[name] = {
+            "category": category,
+            "step": f"{name}.step",
+            "stl": f"{name}.stl",
+            "sizes": {ext: os.path.getsize(path) for ext, path in paths.items()}
+        }
+
+    with open(manifest_path, "w") as f:
+        json.dump({"version": CORPUS_VERSION, "files": manifest}, f, indent=2)
+
+    return {name: entry for name, entry in manifest.items() if not names or name in names}
@@ -0,0 +1,368 @@
+"""
+Benchmark the conversion stages and API endpoints against a synthetic corpus
+Authors: Josh Ayokhai & River
+
+Run from the directory that contains main.py and the app package:
+
+    python -m app.benchmarks.run --output results.json
+    python -m app.benchmarks.run --compare results.json --output new.json
+
+Everything runs offline: the corpus is served by a local file server and AI
+calls go to a fake OpenRouter endpoint. Result and AI caches are disabled so
+repeated runs measure real work.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.benchmarks.corpus import CORPUS_VERSION, build_corpus
+from app.benchmarks.stubs import file_server, fake_openrouter
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "cad-converter-bench-corpus")
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=PACKAGE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summarize(timings, peak_bytes):
+    return {
+        "median_s": round(statistics.median(timings), 6),
+        "min_s": round(min(timings), 6),
+        "runs": len(timings),
+        "peak_python_mb": round(peak_bytes / 1024 / 1024, 3)
+    }
+
+
+def measure(fn, repeat):
+    """
+    Time fn() `repeat` times, then run it once more under tracemalloc for its
+    peak Python allocation (tracing is kept out of the timed runs). Returns the
+    last result and its summary.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, _summarize(timings, peak)
+
+
+async def measure_async(fn, repeat):
+    """measure() for coroutine functions"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        await fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, _summarize(timings, peak)
+
+
+# Libraries the web process should not import at startup (workers load them)
+HEAVY_MODULES = ("numpy", "trimesh", "cadquery", "OCP")
+
+_STARTUP_SNIPPETS = {
+    # Web process: import the app as uvicorn does
+    "import_app": "import main",
+    # Conversion worker: load the CAD and mesh stack
+    "worker_warm_up": "from app.converter import warm_up; warm_up()",
+}
+
+
+def bench_startup(repeat):
+    """Time cold imports in fresh interpreters, and check the app doesn't load heavy libraries"""
+    results = {}
+    for name, snippet in _STARTUP_SNIPPETS.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", snippet], check=True)
+            timings.append(time.perf_counter() - start)
+        results[name] = _summarize(timings, 0)
+        del results[name]["peak_python_mb"]
+
+    check = f"import sys, main; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", check], check=True, capture_output=True, text=True)
+    results["heavy_modules_loaded_by_app"] = [m for m in loaded.stdout.strip().split(",") if m]
+    return results
+
+
+async def bench_file_stages(filename, file_type, corpus_dir, corpus_url, repeat):
+    """Time each pipeline stage in-process for one corpus file"""
+    from OCP.BRepTools import BRepTools
+    from app.converter import (
+        import_step_shape, tessellate_shape, load_mesh, mesh_dimensions, export_mesh,
+        brep_properties, mesh_properties
+    )
+    from app.metadata import extract_step_metadata
+    from app.download import download_to_file
+
+    stages = {}
+
+    async def download():
+        downloaded = await download_to_file(f"{corpus_url}/{filename}", f".{file_type}")
+        os.unlink(downloaded.path)
+        return downloaded
+
+    _, stages["download"] = await measure_async(download, repeat)
+
+    path = os.path.join(corpus_dir, filename)
+    if file_type == "step":
+        _, stages["metadata"] = measure(lambda: extract_step_metadata(path), repeat)
+        shape, stages["step_import"] = measure(lambda: import_step_shape(path), repeat)
+        _, stages["brep_properties"] = measure(lambda: brep_properties(shape.wrapped), repeat)
+
+        def tessellate():
+            # OCC keeps face triangulations on the shape; drop them so every run meshes
+            BRepTools.Clean_s(shape.wrapped)
+            return tessellate_shape(shape)
+
+        mesh, stages["tessellation"] = measure(tessellate, repeat)
+    else:
+        mesh, stages["stl_load"] = measure(lambda: load_mesh(path, "stl"), repeat)
+        _, stages["mesh_properties"] = measure(lambda: mesh_properties(mesh), repeat)
+
+    _, stages["dimensions"] = measure(lambda: mesh_dimensions(mesh), repeat)
+    _, stages["gltf_export"] = measure(lambda: export_mesh(mesh, "gltf"), repeat)
+    _, stages["glb_export"] = measure(lambda: export_mesh(mesh, "glb"), repeat)
+
+    return {"triangles": len(mesh.faces), "stages": stages}
+
+
+async def _child_file_stages(args):
+    """Entry point of the per-file subprocess started by bench_stages"""
+    from app.http_clients import start_http_clients, close_http_clients
+
+    start_http_clients()
+    try:
+        result = await bench_file_stages(
+            args.stages_for, args.file_type, args.corpus_dir, args.corpus_url, args.repeat
+        )
+    finally:
+        await close_http_clients()
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def bench_stages(corpus, corpus_dir, corpus_url, repeat):
+    """
+    Time each pipeline stage per corpus file. Every file is measured in a
+    fresh process, so its peak_rss_mb is that file's own peak, not the
+    largest file's so far.
+    """
+    results = {}
+    for entry in corpus.values():
+        for file_type in ("step", "stl"):
+            filename = entry[file_type]
+            child = subprocess.run(
+                [
+                    sys.executable, "-m", "app.benchmarks.run",
+                    "--stages-for", filename,
+                    "--file-type", file_type,
+                    "--corpus-dir", corpus_dir,
+                    "--corpus-url", corpus_url,
+                    "--repeat", str(repeat)
+                ],
+                cwd=os.path.dirname(PACKAGE_DIR), check=True, capture_output=True, text=True
+            )
+            # The result is the last line; the code under test may print too
+            measured = json.loads(child.stdout.strip().splitlines()[-1])
+
+            results[filename] = {
+                "category": entry["category"],
+                "size_bytes": entry["sizes"][file_type],
+                **measured
+            }
+            print(f"  {filename}: {measured['triangles']} triangles", file=sys.stderr)
+    return results
+
+
+async def bench_endpoints(corpus, corpus_url, repeat):
+    """Time the API endpoints end to end (worker pool, stub downloads, fake AI)"""
+    import httpx
+    from main import app, lifespan
+
+    results = {}
+    step_files = [entry["step"] for entry in corpus.values()]
+
+    async def call(client, method, path, body):
+        response = await client.request(method, path, json=body)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+    async with lifespan(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for filename in step_files:
+                body = {"fileUrl": f"{corpus_url}/{filename}", "fileType": "step", "apiKey": "bench-key"}
+                for path in ("/api/convert", "/api/metadata"):
+                    response, summary = await measure_async(lambda: call(client, "POST", path, body), repeat)
+                    summary["response_bytes"] = len(response.content)
+                    results[f"POST {path} {filename}"] = summary
+
+            batch = {
+                "files": [{"fileUrl": f"{corpus_url}/{f}", "fileType": "step"} for f in step_files],
+                "apiKey": "bench-key",
+                "generateBOM": True
+            }
+            response, summary = await measure_async(
+                lambda: call(client, "POST", "/api/batch-convert", batch), repeat
+            )
+            summary["response_bytes"] = len(response.content)
+            results["POST /api/batch-convert"] = summary
+
+    return results
+
+
+def _flatten(results):
+    """{benchmark name: median seconds} for comparing two result files"""
+    flat = {}
+    for filename, entry in results.get("stages", {}).items():
+        for stage, summary in entry["stages"].items():
+            flat[f"{filename} {stage}"] = summary["median_s"]
+    for name, summary in results.get("endpoints", {}).items():
+        flat[name] = summary["median_s"]
+    for name, summary in results.get("startup", {}).items():
+        if isinstance(summary, dict):
+            flat[f"startup {name}"] = summary["median_s"]
+    return flat
+
+
+def compare(baseline, current):
+    """Print the median time change of every benchmark present in both runs"""
+    if baseline["meta"].get("corpus_version") != current["meta"].get("corpus_version"):
+        print("Warning: results were produced from different corpus versions", file=sys.stderr)
+
+    before = _flatten(baseline)
+    after = _flatten(current)
+    width = max((len(name) for name in after), default=10)
+    print(f"{'benchmark':<{width}}  {'before':>10}  {'after':>10}  {'change':>8}")
+    for name, seconds in after.items():
+        if name not in before:
+            continue
+        change = (seconds - before[name]) / before[name] * 100 if before[name] else 0.0
+        print(f"{name:<{width}}  {before[name]:>10.4f}  {seconds:>10.4f}  {change:>+7.1f}%")
+
+
+async def run(args):
+    corpus = build_corpus(args.corpus_dir, args.only)
+    print(f"Corpus: {len(corpus)} shapes in {args.corpus_dir}", file=sys.stderr)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus_version": CORPUS_VERSION,
+            "repeat": args.repeat
+        }
+    }
+
+    if not args.skip_startup:
+        print("Startup:", file=sys.stderr)
+        results["startup"] = bench_startup(args.repeat)
+
+    with file_server(args.corpus_dir) as files:
+        if not args.skip_stages:
+            print("Stages:", file=sys.stderr)
+            results["stages"] = await asyncio.to_thread(
+                bench_stages, corpus, args.corpus_dir, files.url, args.repeat
+            )
+
+        if not args.skip_endpoints:
+            print("Endpoints:", file=sys.stderr)
+            results["endpoints"] = await bench_endpoints(corpus, files.url, args.repeat)
+
+    # Peak of this process only: stage benchmarks run in child processes
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write results JSON to this file (default: stdout)")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="Where the corpus is generated")
+    parser.add_argument("--only", nargs="+", help="Only benchmark these corpus shapes")
+    parser.add_argument("--ai-latency", type=float, default=0.0, help="Seconds the fake AI endpoint waits")
+    parser.add_argument("--skip-stages", action="store_true")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--skip-startup", action="store_true")
+    # Used by bench_stages to measure one file in a child process
+    parser.add_argument("--stages-for", help=argparse.SUPPRESS)
+    parser.add_argument("--file-type", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stages_for:
+        # The parent has already set up the environment
+        print(json.dumps(asyncio.run(_child_file_stages(args))))
+        return
+
+    with fake_openrouter(args.ai_latency) as ai, tempfile.TemporaryDirectory() as scratch:
+        # Must be set before the app's config is imported
+        os.environ.update({
+            "OPENROUTER_BASE_URL": ai.url,
+            "CACHE_ENABLED": "false",
+            "AI_CACHE_ENABLED": "false",
+            "AI_RATE_LIMIT_PER_MINUTE": "0",
+            "JOB_DB_PATH": os.path.join(scratch, "jobs.sqlite3")
+        })
+        results = asyncio.run(run(args))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
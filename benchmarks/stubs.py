@@ -0,0 +1,86 @@
+"""
+Local HTTP stubs so benchmarks run offline: a static file server for the
+corpus and a fake OpenRouter chat completions endpoint
+Authors: Josh Ayokhai & River
+"""
+import functools
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, BaseHTTPRequestHandler
+
+# Answer returned by the fake OpenRouter; valid for both part analysis and BOM prompts
+FAKE_AI_ANSWER = {
+    "part_name": "Benchmark part",
+    "part_number": "BENCH-001",
+    "description": "Synthetic benchmark geometry",
+    "category": "mechanical",
+    "material": "Aluminum",
+    "bom_name": "Benchmark BOM",
+    "total_parts": 1,
+    "parts": []
+}
+
+
+class _QuietFileHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps({
+            "id": "bench",
+            "model": request.get("model"),
+            "choices": [{
+                "message": {"role": "assistant", "content": json.dumps(FAKE_AI_ANSWER)}
+            }]
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """An HTTP server on a free localhost port, served from a background thread"""
+
+    def __init__(self, handler):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def file_server(directory):
+    """Serve the files in directory"""
+    return StubServer(functools.partial(_QuietFileHandler, directory=directory))
+
+
+def fake_openrouter(latency=0.0):
+    """Answer every chat completion with FAKE_AI_ANSWER after `latency` seconds"""
+    handler = type("FakeOpenRouterHandler", (_FakeOpenRouterHandler,), {"latency": latency})
+    return StubServer(handler)
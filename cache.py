@@ -0,0 +1,97 @@
+"""
+Content-addressed cache for conversion results
+Authors: Josh Ayokhai & River
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from app.config import CACHE_ENABLED, CACHE_DIR, CACHE_MAX_SIZE
+
+# Bump when the shape of cached entries changes so old entries are ignored
+CACHE_FORMAT_VERSION = 7
+
+
+def cache_key(file_hash, **params):
+    """Build a cache key from the SHA-256 of the input bytes and the conversion parameters"""
+    key_data = json.dumps(
+        {"file": file_hash, "version": CACHE_FORMAT_VERSION, "params": params},
+        sort_keys=True
+    )
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class ConversionCache:
+    """
+    Disk cache of JSON entries with a total size cap.
+    Entries are evicted least recently used first; reads refresh an entry's mtime.
+    """
+
+    def __init__(self, directory, max_size, enabled=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.enabled = enabled and max_size > 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached entry for key, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        """Store an entry, then evict old entries until the cache fits its size cap"""
+        if not self.enabled:
+            return
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+                total_size -= size
+            except OSError:
+                pass
+
+
+conversion_cache = ConversionCache(CACHE_DIR, CACHE_MAX_SIZE, CACHE_ENABLED)
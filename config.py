@@ -3,6 +3,7 @@ Configuration settings
 Authors: Josh Ayokhai & River
 """
 import os
+import tempfile
 
 # =============================================================================
 # Service Configuration
@@ -12,6 +13,9 @@ import os
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "100"))
 MAX_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
 
+# Files accepted in one multipart upload
+MAX_UPLOAD_FILES = int(os.getenv("MAX_UPLOAD_FILES", "50"))
+
 # CORS settings
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
@@ -29,6 +33,31 @@ if _supported_formats_env:
 else:
     SUPPORTED_FORMATS = ["step", "stp", "stl"]
 
+# 3D output formats: glTF JSON with embedded buffers, or base64-encoded binary GLB
+OUTPUT_FORMATS = ["gltf", "glb"]
+
+# Compact mesh encodings: "optimized" welds vertices, reorders triangles for
+# locality and uses 16-bit indices where possible; "quantized" also stores
+# positions as 16-bit integers (KHR_mesh_quantization)
+MESH_ENCODINGS = ["optimized", "quantized"]
+
+# Maximum number of decimated level-of-detail previews per request
+MAX_LOD_LEVELS = int(os.getenv("MAX_LOD_LEVELS", "4"))
+
+# STEP tessellation quality tiers. Linear deflection is relative to edge size,
+# angular deflection is in radians; larger values are faster and coarser.
+TESSELLATION_QUALITY = {
+    "draft": {"linearDeflection": 0.5, "angularDeflection": 0.5},
+    "standard": {"linearDeflection": 0.1, "angularDeflection": 0.1},
+    "fine": {"linearDeflection": 0.01, "angularDeflection": 0.05}
+}
+DEFAULT_TESSELLATION_QUALITY = os.getenv("DEFAULT_TESSELLATION_QUALITY", "standard")
+if DEFAULT_TESSELLATION_QUALITY not in TESSELLATION_QUALITY:
+    raise ValueError(
+        f"DEFAULT_TESSELLATION_QUALITY must be one of {', '.join(TESSELLATION_QUALITY)}, "
+        f"not '{DEFAULT_TESSELLATION_QUALITY}'"
+    )
+
 # =============================================================================
 # AI Configuration
 # =============================================================================
@@ -48,6 +77,27 @@ DEFAULT_AI_MODEL = os.getenv("DEFAULT_AI_MODEL", "anthropic/claude-3.5-sonnet")
 # OpenRouter API key (optional - users can provide their own in requests)
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 
+# OpenRouter API base URL (override to point at a proxy or a local stub)
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+
+# Identical AI prompts (same inputs and model) are answered from an in-memory cache
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "86400"))
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1000"))
+
+# Estimated token budgets for AI prompts. Files are described by a compact
+# summary (names, assembly tree, units, entity counts, materials) cut to fit.
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "1000"))
+AI_BOM_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_BOM_PROMPT_TOKEN_BUDGET", "4000"))
+
+# AI request dispatch: concurrent calls, per-API-key rate limit and retries
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_RATE_LIMIT_PER_MINUTE = float(os.getenv("AI_RATE_LIMIT_PER_MINUTE", "60"))  # 0 disables
+AI_RATE_LIMIT_BURST = int(os.getenv("AI_RATE_LIMIT_BURST", "10"))
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1.0"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "30"))
+
 # =============================================================================
 # GitHub & Attribution
 # =============================================================================
@@ -72,3 +122,76 @@ DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 # Timeouts (in seconds)
 DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "120"))
 AI_TIMEOUT = int(os.getenv("AI_TIMEOUT", "120"))
+
+# Wall-clock limits for conversion stages in worker processes, enforced by
+# killing the worker; WORKER_JOB_TIMEOUT caps a whole job. 0 disables a limit.
+STEP_IMPORT_TIMEOUT = int(os.getenv("STEP_IMPORT_TIMEOUT", "300"))
+TESSELLATION_TIMEOUT = int(os.getenv("TESSELLATION_TIMEOUT", "300"))
+EXPORT_TIMEOUT = int(os.getenv("EXPORT_TIMEOUT", "120"))
+WORKER_JOB_TIMEOUT = int(os.getenv("WORKER_JOB_TIMEOUT", "900"))
+
+# Downloads are streamed to disk in chunks of this many bytes
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Number of worker processes used for CAD conversion (defaults to CPU count)
+CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", str(os.cpu_count() or 1)))
+
+# OCC and trimesh don't give all memory back, so workers are replaced after
+# this many jobs, or once their resident memory passes WORKER_MAX_RSS_MB
+# (checked after every job). 0 disables either limit.
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "200"))
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "2048"))
+# Times a job is retried on a fresh worker after its worker died (e.g. OOM-killed)
+WORKER_CRASH_RETRIES = int(os.getenv("WORKER_CRASH_RETRIES", "1"))
+
+# Per-batch concurrency limits for each pipeline stage
+BATCH_DOWNLOAD_CONCURRENCY = int(os.getenv("BATCH_DOWNLOAD_CONCURRENCY", "8"))
+BATCH_CONVERT_CONCURRENCY = int(os.getenv("BATCH_CONVERT_CONCURRENCY", str(CONVERSION_WORKERS)))
+BATCH_AI_CONCURRENCY = int(os.getenv("BATCH_AI_CONCURRENCY", "4"))
+# Files of a streamed batch being processed at once; results that have been
+# sent are dropped, so memory is bounded by this, not by the batch size
+BATCH_STREAM_IN_FLIGHT = int(os.getenv("BATCH_STREAM_IN_FLIGHT", "16"))
+
+# =============================================================================
+# Caching
+# =============================================================================
+
+# Conversion results are cached on disk, keyed on the SHA-256 of the input file
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "cad-converter-cache"))
+CACHE_MAX_SIZE_MB = int(os.getenv("CACHE_MAX_SIZE_MB", "1024"))
+CACHE_MAX_SIZE = CACHE_MAX_SIZE_MB * 1024 * 1024
+
+# Converted meshes can be stored as files and returned by URL (/api/artifacts).
+# Files are named by the SHA-256 of their contents and deleted once they have
+# not been produced or re-used for ARTIFACT_TTL seconds.
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "cad-converter-artifacts"))
+ARTIFACT_TTL = int(os.getenv("ARTIFACT_TTL", "86400"))
+ARTIFACT_GC_INTERVAL = int(os.getenv("ARTIFACT_GC_INTERVAL", "600"))
+
+# =============================================================================
+# HTTP Client Pools
+# =============================================================================
+
+# Shared connection pools, one for file downloads and one for the AI endpoint
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "50"))
+DOWNLOAD_MAX_KEEPALIVE = int(os.getenv("DOWNLOAD_MAX_KEEPALIVE", "20"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "20"))
+AI_MAX_KEEPALIVE = int(os.getenv("AI_MAX_KEEPALIVE", "10"))
+
+# =============================================================================
+# Asynchronous Jobs
+# =============================================================================
+
+# SQLite database holding queued jobs and their results
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(tempfile.gettempdir(), "cad-converter-jobs.sqlite3"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# A running job whose process stops renewing its lease this long is requeued
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+# A job claimed this many times without finishing (its process died or it kept
+# overrunning its lease) is failed instead of being run again
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
@@ -1,42 +1,107 @@
 """
 CAD file conversion utilities
 Authors: Josh Ayokhai & River
+
+cadquery (with OCP), trimesh and numpy take seconds to import, so they are
+imported inside the functions that use them. The web process never needs
+them; conversion workers load them up front through warm_up().
 """
-import trimesh
+import base64
+import hashlib
+import importlib.util
 import json
+import os
+import struct
+
+from app.metrics import stage_clock
+
+# Checked without importing, so the web process starts without loading OCC
+CAD_AVAILABLE = importlib.util.find_spec("cadquery") is not None
+
+
+def warm_up():
+    """Import the CAD and mesh stack so the first conversion doesn't pay for it"""
+    import numpy  # noqa: F401
+    import trimesh  # noqa: F401
+    import trimesh.exchange.gltf  # noqa: F401
+    import app.lod  # noqa: F401
+    import app.mesh_encoding  # noqa: F401
+    if CAD_AVAILABLE:
+        import cadquery  # noqa: F401
 
-try:
-    import cadquery as cq
-    CAD_AVAILABLE = True
-except ImportError:
-    CAD_AVAILABLE = False
 
+def saved_shape_path(input_path):
+    """Where file_properties keeps the imported shape of a STEP file for convert_cad_file"""
+    return input_path + ".brep"
 
-def convert_step_to_stl(input_path, output_path):
-    """Convert STEP file to STL"""
+
+def save_shape(shape, input_path):
+    """Save an imported shape next to its STEP file as BREP, which reads back far faster than STEP"""
+    from OCP.BRepTools import BRepTools
+    
+    BRepTools.Write_s(shape.wrapped, saved_shape_path(input_path))
+
+
+def import_step_shape(input_path):
+    """
+    Read a STEP file into a single compound shape, reusing the shape saved
+    by save_shape if there is one
+    """
     if not CAD_AVAILABLE:
         raise RuntimeError("CAD libraries not installed")
+    import cadquery as cq
     
-    result = cq.importers.importStep(input_path)
-    cq.exporters.export(result, output_path)
-    return output_path
+    saved = saved_shape_path(input_path)
+    if os.path.exists(saved):
+        from OCP.BRep import BRep_Builder
+        from OCP.BRepTools import BRepTools
+        from OCP.TopoDS import TopoDS_Shape
+        
+        shape = TopoDS_Shape()
+        if BRepTools.Read_s(shape, saved, BRep_Builder()) and not shape.IsNull():
+            return cq.Shape.cast(shape)
+    
+    return cq.importers.importStep(input_path).toCompound()
 
 
-def convert_stl_to_gltf(stl_path, gltf_path):
-    """Convert STL to glTF format"""
-    mesh = trimesh.load(stl_path)
-    mesh.export(gltf_path, file_type='gltf')
+def tessellate_shape(shape, tolerance=0.1, angular_tolerance=0.1):
+    """Tessellate a shape into a trimesh"""
+    import numpy as np
+    import trimesh
+    
+    vertices, triangles = shape.tessellate(tolerance, angular_tolerance)
     
-    with open(gltf_path, 'r') as f:
-        gltf_json = json.load(f)
+    return trimesh.Trimesh(
+        vertices=np.array([v.toTuple() for v in vertices], dtype=np.float64).reshape(-1, 3),
+        faces=np.array(triangles, dtype=np.int64).reshape(-1, 3)
+    )
+
+
+def load_step_mesh(input_path, tolerance=0.1, angular_tolerance=0.1):
+    """Import a STEP file and tessellate it straight into an in-memory mesh"""
+    return tessellate_shape(import_step_shape(input_path), tolerance, angular_tolerance)
+
+
+def load_mesh(input_path, file_type, linear_deflection=0.1, angular_deflection=0.1):
+    """Load a STEP or STL file as a single mesh; deflections only apply to STEP tessellation"""
+    file_type = file_type.lower()
     
-    return gltf_json
+    if file_type in ["step", "stp"]:
+        return load_step_mesh(input_path, linear_deflection, angular_deflection)
+    elif file_type == "stl":
+        import trimesh
+        return trimesh.load(input_path, file_type="stl", force="mesh")
+    else:
+        raise ValueError(f"File type '{file_type}' not supported")
 
 
-def calculate_dimensions(stl_path):
-    """Calculate dimensions from STL mesh"""
-    mesh = trimesh.load(stl_path)
+def mesh_dimensions(mesh):
+    """Calculate dimensions from a mesh"""
+    import numpy as np
+    
     bounds = mesh.bounds
+    if bounds is None:
+        bounds = np.zeros((2, 3))
     
     dimensions = {
         'length': float(bounds[1][0] - bounds[0][0]),
@@ -49,6 +114,434 @@ def calculate_dimensions(stl_path):
     return dimensions
 
 
+def _xyz(point):
+    return [float(point.X()), float(point.Y()), float(point.Z())]
+
+
+def brep_properties(shape):
+    """
+    Dimensions and mass properties straight from a B-rep shape, without tessellating.
+    The axis-aligned and oriented bounding boxes are fitted to the exact
+    geometry; volume, surface area and centre of mass come from GProp integration.
+    """
+    from OCP.Bnd import Bnd_Box, Bnd_OBB
+    from OCP.BRepBndLib import BRepBndLib
+    from OCP.BRepGProp import BRepGProp
+    from OCP.GProp import GProp_GProps
+    
+    box = Bnd_Box()
+    BRepBndLib.AddOptimal_s(shape, box, False, False)
+    low = high = [0.0, 0.0, 0.0]
+    if not box.IsVoid():
+        low, high = _xyz(box.CornerMin()), _xyz(box.CornerMax())
+    
+    volume_props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(shape, volume_props)
+    surface_props = GProp_GProps()
+    BRepGProp.SurfaceProperties_s(shape, surface_props)
+    # Shapes without solids (bare surfaces) have no volume; fall back to the area centroid
+    centre_props = volume_props if volume_props.Mass() > 0 else surface_props
+    
+    obb = Bnd_OBB()
+    BRepBndLib.AddOBB_s(shape, obb, False, True, False)
+    oriented = None
+    if not obb.IsVoid():
+        oriented = {
+            "center": _xyz(obb.Center()),
+            "axes": [_xyz(obb.XDirection()), _xyz(obb.YDirection()), _xyz(obb.ZDirection())],
+            "size": [2 * obb.XHSize(), 2 * obb.YHSize(), 2 * obb.ZHSize()]
+        }
+    
+    return _properties_result(
+        low, high, volume_props.Mass(), surface_props.Mass(),
+        _xyz(centre_props.CentreOfMass()), oriented
+    )
+
+
+def mesh_properties(mesh):
+    """The same properties as brep_properties, measured on a mesh (for STL files)"""
+    import numpy as np
+    
+    if len(mesh.faces) == 0:
+        return _properties_result([0.0] * 3, [0.0] * 3, 0.0, 0.0, [0.0] * 3, None)
+    
+    # Boxed along the principal axes of inertia: close to the minimal box
+    # for most parts, and needs no convex hull (scipy)
+    axes = mesh.principal_inertia_vectors
+    projected = mesh.vertices @ axes.T
+    low, high = projected.min(axis=0), projected.max(axis=0)
+    oriented = {
+        "center": [float(v) for v in ((low + high) / 2) @ axes],
+        "axes": [[float(v) for v in axis] for axis in axes],
+        "size": [float(v) for v in high - low]
+    }
+    centre = mesh.center_mass if mesh.is_volume else mesh.centroid
+    return _properties_result(
+        mesh.bounds[0].tolist(), mesh.bounds[1].tolist(), float(mesh.volume),
+        float(mesh.area), [float(v) for v in centre], oriented
+    )
+
+
+def _properties_result(low, high, volume, area, centre, oriented):
+    return {
+        "dimensions": {
+            "length": float(high[0] - low[0]),
+            "width": float(high[1] - low[1]),
+            "height": float(high[2] - low[2]),
+            "volume": float(volume),
+            "units": "mm"
+        },
+        "properties": {
+            "surfaceArea": float(area),
+            "centerOfMass": centre,
+            "boundingBox": {"min": low, "max": high},
+            "orientedBoundingBox": oriented
+        }
+    }
+
+
+def file_properties(input_path, file_type, keep_shape=False):
+    """
+    Dimensions and mass properties of a CAD file. STEP files are measured on
+    the imported B-rep with no tessellation; STL files on their mesh.
+    With keep_shape, a STEP file's shape is saved (see save_shape) so a later
+    conversion doesn't import it again.
+    Runs inside a conversion worker process.
+    """
+    timings = {}
+    
+    if file_type.lower() in ["step", "stp"]:
+        with stage_clock(timings, "step_import"):
+            shape = import_step_shape(input_path)
+        if keep_shape:
+            with stage_clock(timings, "shape_save"):
+                save_shape(shape, input_path)
+        with stage_clock(timings, "properties"):
+            result = brep_properties(shape.wrapped)
+            result["fingerprint"] = brep_fingerprint(shape.wrapped)
+    else:
+        with stage_clock(timings, "mesh_load"):
+            mesh = load_mesh(input_path, file_type)
+        with stage_clock(timings, "properties"):
+            result = mesh_properties(mesh)
+            result["fingerprint"] = shape_fingerprint(mesh)
+    
+    result["timings"] = timings
+    return result
+
+
+# Principal moments this close (relative to the largest) are treated as equal
+_DEGENERATE_INERTIA = 1e-3
+
+
+def _fingerprint_hash(features, significant_digits, handedness=0):
+    scale = max(abs(f) for f in features) or 1.0
+    rounded = [
+        "0" if abs(f) < scale * 1e-9 else f"{abs(f):.{significant_digits}g}"
+        for f in features
+    ]
+    rounded.append(str(handedness))
+    return hashlib.sha256(",".join(rounded).encode("ascii")).hexdigest()[:32]
+
+
+def _principal_features(moments, axes, low, high, centre, surface_centre):
+    """
+    Fingerprint features and handedness from principal moments, the principal
+    axes (columns), and the bounding box (low, high), centre of mass and
+    centroid of the surface of the shape in the principal frame.
+
+    Extents are only kept along axes whose moment is distinct: when two moments
+    are equal (a turned or hexagonal part) the axes in that plane are arbitrary,
+    and so is the box. Each distinct axis is pointed towards the side where the
+    box reaches furthest from the centre of mass, or failing that where the
+    surface centroid lies; the sign of the determinant of those axes is the
+    handedness, which tells mirror images apart. A shape with a degenerate
+    axis, or one neither reference orients, reports 0.
+    """
+    import numpy as np
+    
+    order = np.argsort(moments)
+    moments = np.asarray(moments, dtype=float)[order]
+    axes = np.asarray(axes, dtype=float)[:, order]
+    extents = (np.asarray(high) - np.asarray(low))[order]
+    centre = np.asarray(centre, dtype=float)
+    box_offsets = ((np.asarray(high) + np.asarray(low)) / 2 - centre)[order]
+    surface_offsets = (np.asarray(surface_centre, dtype=float) - centre)[order]
+    
+    tolerance = _DEGENERATE_INERTIA * (abs(moments[-1]) or 1.0)
+    distinct = [
+        all(abs(moments[i] - moments[j]) > tolerance for j in range(3) if j != i)
+        for i in range(3)
+    ]
+    
+    features = [float(m) for m in moments]
+    features += [float(extent) for extent, keep in zip(extents, distinct) if keep]
+    
+    tolerance = 1e-6 * (float(extents.max()) or 1.0)
+    signs = [
+        np.sign(box) if abs(box) > tolerance else np.sign(surface) if abs(surface) > tolerance else 0
+        for box, surface in zip(box_offsets, surface_offsets)
+    ]
+    handedness = 0
+    if all(distinct) and all(signs):
+        handedness = 1 if np.linalg.det(axes * np.array(signs)) > 0 else -1
+    return features, handedness
+
+
+def shape_fingerprint(mesh, significant_digits=4):
+    """
+    Rotation- and translation-invariant fingerprint of a mesh's shape.
+    Built from volume, surface area, principal moments of inertia, the extents
+    along the principal axes and the shape's handedness, each rounded to a few
+    significant digits (see _principal_features).
+    """
+    if len(mesh.faces) == 0:
+        return None
+    import numpy as np
+    
+    axes = np.asarray(mesh.principal_inertia_vectors).T
+    projected = (mesh.vertices - mesh.center_mass) @ axes
+    surface_centre = np.average(mesh.triangles_center, axis=0, weights=mesh.area_faces)
+    features, handedness = _principal_features(
+        mesh.principal_inertia_components, axes,
+        projected.min(axis=0), projected.max(axis=0), np.zeros(3),
+        (surface_centre - mesh.center_mass) @ axes
+    )
+    return _fingerprint_hash([float(mesh.volume), float(mesh.area)] + features, significant_digits, handedness)
+
+
+def brep_fingerprint(shape, significant_digits=4):
+    """
+    The features of shape_fingerprint computed on a B-rep shape with GProp
+    and exact bounding boxes, so STEP parts are fingerprinted right after
+    import, before tessellation. Not comparable with mesh fingerprints.
+    """
+    import numpy as np
+    from OCP.Bnd import Bnd_Box
+    from OCP.BRepBndLib import BRepBndLib
+    from OCP.BRepGProp import BRepGProp
+    from OCP.GProp import GProp_GProps
+    from OCP.gp import gp_Trsf
+    from OCP.TopLoc import TopLoc_Location
+    
+    volume_props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(shape, volume_props)
+    surface_props = GProp_GProps()
+    BRepGProp.SurfaceProperties_s(shape, surface_props)
+    if surface_props.Mass() <= 0:
+        return None
+    props = volume_props if volume_props.Mass() > 0 else surface_props
+    
+    # Principal axes from the inertia matrix (about the centre of mass)
+    matrix = props.MatrixOfInertia()
+    inertia = np.array([[matrix.Value(row, column) for column in (1, 2, 3)] for row in (1, 2, 3)])
+    moments, axes = np.linalg.eigh(inertia)
+    if np.linalg.det(axes) < 0:
+        axes[:, 2] = -axes[:, 2]  # keep a proper rotation
+    
+    # Box the shape rotated into the principal frame
+    rotation = axes.T
+    trsf = gp_Trsf()
+    trsf.SetValues(*rotation[0], 0.0, *rotation[1], 0.0, *rotation[2], 0.0)
+    box = Bnd_Box()
+    BRepBndLib.AddOptimal_s(shape.Moved(TopLoc_Location(trsf)), box, False, False)
+    centre = rotation @ np.array(_xyz(props.CentreOfMass()))
+    surface_centre = rotation @ np.array(_xyz(surface_props.CentreOfMass()))
+    
+    features, handedness = _principal_features(
+        moments, axes, _xyz(box.CornerMin()), _xyz(box.CornerMax()), centre, surface_centre
+    )
+    return _fingerprint_hash(
+        [float(volume_props.Mass()), float(surface_props.Mass())] + features, significant_digits, handedness
+    )
+
+
+def export_mesh(mesh, output_format="gltf"):
+    """
+    Export a mesh or scene without touching disk.
+    Returns binary GLB bytes, or a self-contained glTF JSON dict with embedded buffers.
+    """
+    from trimesh.exchange.gltf import export_glb, export_gltf
+    
+    if output_format == "glb":
+        return export_glb(mesh)
+    
+    files = export_gltf(mesh, embed_buffers=True)
+    return json.loads(files["model.gltf"])
+
+
+def glb_with_extras(glb, extras):
+    """
+    Copy of a GLB with extras merged into its top-level glTF "extras".
+    Only the JSON chunk is rewritten; binary chunks are copied as they are.
+    """
+    magic, version, _ = struct.unpack_from("<4sII", glb, 0)
+    json_length, chunk_type = struct.unpack_from("<I4s", glb, 12)
+    if magic != b"glTF" or chunk_type != b"JSON":
+        raise ValueError("Not a GLB file")
+    
+    document = json.loads(glb[20:20 + json_length])
+    document["extras"] = {**document.get("extras", {}), **extras}
+    json_chunk = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    rest = glb[20 + json_length:]
+    return (
+        struct.pack("<4sII", magic, version, 20 + len(json_chunk) + len(rest))
+        + struct.pack("<I4s", len(json_chunk), b"JSON") + json_chunk
+        + rest
+    )
+
+
+def _export_result(mesh, output_format, mesh_encoding=None, store_artifacts=False):
+    """
+    Export a mesh (or scene) into the response field for its format.
+    With a mesh encoding (see MESH_ENCODINGS), a non-empty mesh is written
+    compactly and the result gets an "encoding" size report.
+    With store_artifacts, the export is written to the artifact store and
+    the result holds a reference to it ("artifact") instead of the data.
+    """
+    result = {}
+    if mesh_encoding and len(getattr(mesh, "faces", [])):
+        from app.mesh_encoding import encode_mesh
+        exported, result["encoding"] = encode_mesh(mesh, output_format, mesh_encoding == "quantized")
+    else:
+        exported = export_mesh(mesh, output_format)
+    
+    if store_artifacts:
+        from app.artifacts import artifact_store
+        data = exported if output_format == "glb" else json.dumps(exported, separators=(",", ":")).encode("utf-8")
+        result["artifact"] = artifact_store.put(data, output_format)
+    elif output_format == "glb":
+        result["glb"] = base64.b64encode(exported).decode("ascii")
+    else:
+        result["gltf"] = exported
+    return result
+
+
+def convert_cad_file(
+    input_path,
+    file_type,
+    output_format="gltf",
+    lods=None,
+    linear_deflection=0.1,
+    angular_deflection=0.1,
+    assembly=False,
+    mesh_encoding=None,
+    store_artifacts=False
+):
+    """
+    Convert a downloaded CAD file to glTF/GLB and measure it.
+    The file is loaded and tessellated once; dimensions, the export and any
+    requested levels of detail (dicts with targetTriangles/maxError) share that mesh.
+    With assembly, a STEP file keeps its product structure (see convert_step_assembly).
+    mesh_encoding selects a compact encoding for the exported meshes;
+    store_artifacts returns them as artifact store references.
+    Runs inside a conversion worker process, so arguments and results must be picklable.
+    """
+    from app.lod import build_lods
+    
+    if assembly and file_type.lower() in ["step", "stp"]:
+        return convert_step_assembly(
+            input_path, output_format, linear_deflection, angular_deflection, store_artifacts
+        )
+    
+    timings = {}
+    
+    is_step = file_type.lower() in ["step", "stp"]
+    if is_step:
+        with stage_clock(timings, "step_import"):
+            shape = import_step_shape(input_path)
+        # Same fingerprint as file_properties, so batches can group parts before converting them
+        with stage_clock(timings, "fingerprint"):
+            fingerprint = brep_fingerprint(shape.wrapped)
+        with stage_clock(timings, "tessellation"):
+            mesh = tessellate_shape(shape, linear_deflection, angular_deflection)
+        del shape
+    else:
+        with stage_clock(timings, "mesh_load"):
+            mesh = load_mesh(input_path, file_type)
+    
+    with stage_clock(timings, "dimensions"):
+        result = {
+            "dimensions": mesh_dimensions(mesh),
+            "triangles": len(mesh.faces),
+            "fingerprint": fingerprint if is_step else shape_fingerprint(mesh)
+        }
+    with stage_clock(timings, "export"):
+        result.update(_export_result(mesh, output_format, mesh_encoding, store_artifacts))
+    
+    if lods:
+        result["lods"] = []
+        with stage_clock(timings, "lods"):
+            for level, lod_mesh in zip(lods, build_lods(mesh, lods)):
+                lod_result = {
+                    "targetTriangles": level.get("targetTriangles"),
+                    "maxError": level.get("maxError"),
+                    "triangles": len(lod_mesh.faces)
+                }
+                lod_result.update(_export_result(lod_mesh, output_format, mesh_encoding, store_artifacts))
+                result["lods"].append(lod_result)
+    
+    # Worker-side stage timings; the caller records them and strips them before caching
+    result["timings"] = timings
+    return result
+
+
+def convert_step_assembly(
+    input_path,
+    output_format="gltf",
+    linear_deflection=0.1,
+    angular_deflection=0.1,
+    store_artifacts=False
+):
+    """
+    Convert a STEP assembly into a glTF node tree.
+    Each unique part is tessellated once and drawn by every node that uses it,
+    so 200 identical bolts are one mesh and 200 transforms. Reports the
+    assembly's overall dimensions and each part's dimensions and instance count.
+    """
+    if not CAD_AVAILABLE:
+        raise RuntimeError("CAD libraries not installed")
+    from app.assembly import read_step_assembly, tessellate_parts, build_scene
+    
+    timings = {}
+    
+    with stage_clock(timings, "step_import"):
+        parts, root = read_step_assembly(input_path)
+    with stage_clock(timings, "tessellation"):
+        meshes = tessellate_parts(parts, linear_deflection, angular_deflection)
+    
+    with stage_clock(timings, "dimensions"):
+        scene, instances = build_scene(root, parts, meshes)
+        part_results = []
+        for part, mesh, count in zip(parts, meshes, instances):
+            part_results.append({
+                "name": part.name,
+                "instances": count,
+                "triangles": len(mesh.faces),
+                "dimensions": mesh_dimensions(mesh)
+            })
+        del parts
+        
+        result = {
+            # The scene's volume counts each part once per instance
+            "dimensions": mesh_dimensions(scene),
+            "triangles": sum(part["triangles"] for part in part_results),
+            "instancedTriangles": sum(part["triangles"] * part["instances"] for part in part_results),
+            # Parts are deduplicated within the file; across files, by file hash
+            "fingerprint": None,
+            "assembly": {
+                "nodes": len(scene.graph.nodes_geometry),
+                "parts": part_results
+            }
+        }
+    with stage_clock(timings, "export"):
+        result.update(_export_result(scene, output_format, store_artifacts=store_artifacts))
+    
+    result["timings"] = timings
+    return result
+
+
 def is_cad_available():
     """Check if CAD libraries are available"""
     return CAD_AVAILABLE
@@ -0,0 +1,89 @@
+"""
+Streaming file download with size limit and hashing
+Authors: Josh Ayokhai & River
+"""
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+from urllib.parse import urlparse
+
+from app.http_clients import get_download_client
+from app.config import MAX_FILE_SIZE, DOWNLOAD_CHUNK_SIZE
+
+DownloadedFile = namedtuple("DownloadedFile", ["path", "sha256", "size"])
+
+
+class FileTooLargeError(Exception):
+    """Raised as soon as a file is known to exceed the size limit"""
+
+    def __init__(self, size, limit):
+        self.size = size
+        self.limit = limit
+        super().__init__(f"File size ({size / 1024 / 1024:.1f}MB) exceeds limit")
+
+
+def filename_from_url(url):
+    """File name from a URL's path, ignoring query strings such as signed-URL tokens"""
+    return os.path.basename(urlparse(url).path)
+
+
+class TempFileWriter:
+    """
+    Writes chunks to a temp file, hashing them and enforcing the size limit as
+    they arrive. finish() returns the DownloadedFile; discard() deletes the file.
+    """
+
+    def __init__(self, suffix, max_size=MAX_FILE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(suffix=suffix)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise FileTooLargeError(self.size, self.max_size)
+        self._sha256.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self):
+        self._file.close()
+        return DownloadedFile(self.path, self._sha256.hexdigest(), self.size)
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+async def save_stream(chunks, suffix, max_size=MAX_FILE_SIZE):
+    """
+    Write an async iterator of byte chunks to a temp file.
+    The SHA-256 is computed as chunks arrive, and writing stops as soon as
+    max_size is exceeded. The caller owns (and must delete) the returned path.
+    """
+    writer = TempFileWriter(suffix, max_size)
+    try:
+        async for chunk in chunks:
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+
+    return writer.finish()
+
+
+async def download_to_file(url, suffix, max_size=MAX_FILE_SIZE):
+    """Stream a file from url to disk without holding it in memory"""
+    client = get_download_client()
+    async with client.stream("GET", url, follow_redirects=True) as response:
+        response.raise_for_status()
+
+        # Fail fast when the origin tells us the size up front
+        content_length = response.headers.get("content-length")
+        if content_length and int(content_length) > max_size:
+            raise FileTooLargeError(int(content_length), max_size)
+
+        return await save_stream(response.aiter_bytes(DOWNLOAD_CHUNK_SIZE), suffix, max_size)
@@ -0,0 +1,76 @@
+"""
+Shared HTTP client pools
+Authors: Josh Ayokhai & River
+"""
+import httpx
+
+from app.config import (
+    HTTP2_ENABLED,
+    HTTP_KEEPALIVE_EXPIRY,
+    DOWNLOAD_MAX_CONNECTIONS,
+    DOWNLOAD_MAX_KEEPALIVE,
+    DOWNLOAD_TIMEOUT,
+    AI_MAX_CONNECTIONS,
+    AI_MAX_KEEPALIVE,
+    AI_TIMEOUT
+)
+
+_download_client = None
+_ai_client = None
+
+
+def _http2_available():
+    """HTTP/2 needs the optional h2 package"""
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+        return False
+
+
+def _create_client(max_connections, max_keepalive, timeout):
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+def start_http_clients():
+    """Create the application-wide client pools for file origins and the AI endpoint"""
+    global _download_client, _ai_client
+    if _download_client is None:
+        _download_client = _create_client(DOWNLOAD_MAX_CONNECTIONS, DOWNLOAD_MAX_KEEPALIVE, DOWNLOAD_TIMEOUT)
+    if _ai_client is None:
+        _ai_client = _create_client(AI_MAX_CONNECTIONS, AI_MAX_KEEPALIVE, AI_TIMEOUT)
+
+
+async def close_http_clients():
+    """Close both client pools and their open connections"""
+    global _download_client, _ai_client
+    for client in [_download_client, _ai_client]:
+        if client is not None:
+            await client.aclose()
+    _download_client = None
+    _ai_client = None
+
+
+def get_download_client():
+    """Client pool used to fetch CAD files"""
+    if _download_client is None:
+        start_http_clients()
+    return _download_client
+
+
+def get_ai_client():
+    """Client pool used for OpenRouter calls"""
+    if _ai_client is None:
+        start_http_clients()
+    return _ai_client
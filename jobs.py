@@ -0,0 +1,345 @@
+"""
+Persistent job queue for asynchronous conversions
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import copy
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.models import ConversionRequest, BatchConversionRequest
+from app.pipeline import convert_file, run_batch
+from app.download import filename_from_url
+from app.config import (
+    JOB_DB_PATH,
+    JOB_CONCURRENCY,
+    JOB_RESULT_TTL,
+    JOB_POLL_INTERVAL,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS
+)
+
+JOB_KINDS = {
+    "convert": ConversionRequest,
+    "batch-convert": BatchConversionRequest
+}
+
+
+class JobStore:
+    """
+    SQLite-backed job queue.
+    Running jobs hold a lease that their runner keeps renewing; a job whose lease
+    runs out (its process died) is picked up again by the next runner, up to
+    max_attempts claims in all.
+    """
+
+    def __init__(self, path, max_attempts=JOB_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                lease_expires_at REAL,
+                expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "attempts" not in columns:
+            self._db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def submit(self, kind, request_data):
+        """Queue a job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, status, request, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(request_data), now, now)
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Take the oldest queued job (or one whose runner died) and mark it running.
+        Jobs already claimed max_attempts times are failed instead.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._db.execute(
+                        "SELECT * FROM jobs WHERE status = 'queued' "
+                        "OR (status = 'running' AND lease_expires_at < ?) "
+                        "ORDER BY created_at LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is None or row["attempts"] < self.max_attempts:
+                        break
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?, "
+                        "lease_expires_at = NULL, expires_at = ? WHERE id = ?",
+                        (
+                            f"Job stopped without finishing {row['attempts']} times; not retried",
+                            now,
+                            now + JOB_RESULT_TTL,
+                            row["id"]
+                        )
+                    )
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                        "updated_at = ?, lease_expires_at = ? WHERE id = ?",
+                        (now, now + JOB_LEASE_SECONDS, row["id"])
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def update_progress(self, job_id, progress):
+        """Record progress and renew the job's lease"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ?, lease_expires_at = ? "
+                "WHERE id = ? AND status = 'running'",
+                (json.dumps(progress), now, now + JOB_LEASE_SECONDS, job_id)
+            )
+
+    def renew_lease(self, job_id):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running'",
+                (now + JOB_LEASE_SECONDS, job_id)
+            )
+
+    def finish(self, job_id, result=None, error=None):
+        """Store a job's result or error; it expires JOB_RESULT_TTL seconds later"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?, "
+                "lease_expires_at = NULL, expires_at = ? WHERE id = ?",
+                (
+                    "failed" if error else "completed",
+                    json.dumps(result) if result is not None else None,
+                    error,
+                    now,
+                    now + JOB_RESULT_TTL,
+                    job_id
+                )
+            )
+
+    def requeue(self, job_id):
+        """Put a job interrupted by shutdown back at the front of the queue, without using up an attempt"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), "
+                "lease_expires_at = NULL, updated_at = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def purge_expired(self):
+        """Delete finished jobs whose results have expired"""
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+
+
+class JobRunner:
+    """Drains the job store with a fixed number of concurrent jobs"""
+
+    def __init__(self, store, concurrency=JOB_CONCURRENCY):
+        self.store = store
+        self.concurrency = concurrency
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        # API keys are only held in memory, never written to the job database
+        self._api_keys = {}
+        # Latest unsaved progress per job, and the task saving it
+        self._pending_progress = {}
+        self._progress_writers = {}
+
+    async def submit(self, kind, request):
+        request_data = request.model_dump(exclude={"apiKey"})
+        job_id = await asyncio.to_thread(self.store.submit, kind, request_data)
+        if request.apiKey:
+            self._api_keys[job_id] = request.apiKey
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def get(self, job_id):
+        """A job row, read off the event loop"""
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _run(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim)
+            if job is None:
+                await asyncio.to_thread(self.store.purge_expired)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                result = await self._execute(job)
+                await asyncio.to_thread(self.store.finish, job["id"], result)
+            except asyncio.CancelledError:
+                # Shutting down: let the next runner start this job again
+                await asyncio.to_thread(self.store.requeue, job["id"])
+                raise
+            except Exception as e:
+                await asyncio.to_thread(self.store.finish, job["id"], None, str(e))
+            finally:
+                self._api_keys.pop(job["id"], None)
+
+    async def _execute(self, job):
+        job_id = job["id"]
+        request = JOB_KINDS[job["kind"]](**json.loads(job["request"]))
+        # A job resumed after a restart has lost its key and runs without AI analysis
+        request.apiKey = self._api_keys.get(job_id)
+
+        # Keep the lease alive even while a single stage runs for a long time
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            if job["kind"] == "convert":
+                result = await convert_file(
+                    request,
+                    on_stage=lambda stage: self._report_progress(job_id, {"stage": stage})
+                )
+            else:
+                result = await self._run_batch(job_id, request)
+
+            # Save the last progress report before the job's final state
+            writer = self._progress_writers.get(job_id)
+            if writer is not None:
+                await writer
+            return result
+        finally:
+            heartbeat.cancel()
+            # Stopped early: progress saved after the job's final state is ignored anyway
+            self._pending_progress.pop(job_id, None)
+            writer = self._progress_writers.pop(job_id, None)
+            if writer is not None:
+                writer.cancel()
+
+    async def _run_batch(self, job_id, request):
+        """Run a batch job, reporting each file's status as it finishes"""
+        progress = {
+            "total": len(request.files),
+            "completed": 0,
+            "failed": 0,
+            "files": [
+                {"filename": f.fileName or filename_from_url(f.fileUrl), "status": "pending"}
+                for f in request.files
+            ]
+        }
+
+        def on_result(index, file_result):
+            progress["completed"] += 1
+            if not file_result.get("success"):
+                progress["failed"] += 1
+            progress["files"][index]["status"] = "done" if file_result.get("success") else "failed"
+            self._report_progress(job_id, progress)
+
+        self._report_progress(job_id, progress)
+        return await run_batch(request, on_result=on_result)
+
+    def _report_progress(self, job_id, progress):
+        """
+        Save a job's progress from a synchronous callback without blocking the
+        event loop. Saves happen one at a time per job, in order; if several
+        reports arrive during a save, only the latest is written next.
+        """
+        self._pending_progress[job_id] = copy.deepcopy(progress)
+        if job_id not in self._progress_writers:
+            self._progress_writers[job_id] = asyncio.ensure_future(self._write_progress(job_id))
+
+    async def _write_progress(self, job_id):
+        try:
+            while job_id in self._pending_progress:
+                progress = self._pending_progress.pop(job_id)
+                await asyncio.to_thread(self.store.update_progress, job_id, progress)
+        finally:
+            if self._progress_writers.get(job_id) is asyncio.current_task():
+                del self._progress_writers[job_id]
+
+    async def _heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await asyncio.to_thread(self.store.renew_lease, job_id)
+
+
+_runner = None
+
+
+def start_job_runner():
+    """Open the job database and start draining it"""
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(JobStore(JOB_DB_PATH))
+        _runner.start()
+    return _runner
+
+
+async def stop_job_runner():
+    """Stop taking jobs; running jobs are picked up again after restart"""
+    global _runner
+    if _runner is not None:
+        await _runner.stop()
+        _runner = None
+
+
+def get_job_runner():
+    return _runner or start_job_runner()
+
+
+def job_status(job):
+    """Public view of a job row (without its request or result)"""
+    return {
+        "jobId": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": json.loads(job["progress"]) if job["progress"] else None,
+        "error": job["error"],
+        "createdAt": job["created_at"],
+        "updatedAt": job["updated_at"],
+        "expiresAt": job["expires_at"]
+    }
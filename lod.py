@@ -0,0 +1,83 @@
+"""
+Level-of-detail mesh generation
+Authors: Josh Ayokhai & River
+"""
+import numpy as np
+import trimesh
+
+# Binary search steps when fitting a cell size to a triangle budget
+_SEARCH_STEPS = 16
+
+
+def cluster_vertices(mesh, cell_size):
+    """
+    Decimate a mesh by vertex clustering: vertices in the same grid cell
+    collapse to their mean, and triangles that become degenerate are dropped.
+    No vertex moves further than the cell diagonal.
+    """
+    vertices = mesh.vertices
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell_size).astype(np.int64)
+    _, cluster, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    cluster = cluster.reshape(-1)
+
+    # Mean position of each cluster
+    new_vertices = np.zeros((len(counts), 3))
+    np.add.at(new_vertices, cluster, vertices)
+    new_vertices /= counts[:, None]
+
+    faces = cluster[mesh.faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+
+    # Drop triangles that collapsed onto the same three clusters
+    _, unique_faces = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    faces = faces[np.sort(unique_faces)]
+
+    simplified = trimesh.Trimesh(vertices=new_vertices, faces=faces, process=False)
+    simplified.remove_unreferenced_vertices()
+    return simplified
+
+
+def decimate_to_error(mesh, max_error):
+    """Decimate so no vertex moves more than max_error (model units)"""
+    return cluster_vertices(mesh, max_error / np.sqrt(3))
+
+
+def decimate_to_triangles(mesh, target_triangles):
+    """Decimate to the finest clustering that fits within target_triangles"""
+    if len(mesh.faces) <= target_triangles:
+        return mesh
+
+    # Search between a cell far finer than the model and one covering all of it
+    low = float(mesh.extents.max()) * 1e-6 or 1e-6
+    high = float(mesh.extents.max()) or 1.0
+    best = cluster_vertices(mesh, high)
+
+    for _ in range(_SEARCH_STEPS):
+        cell_size = np.sqrt(low * high)
+        candidate = cluster_vertices(mesh, cell_size)
+        if len(candidate.faces) <= target_triangles:
+            best = candidate
+            high = cell_size
+        else:
+            low = cell_size
+
+    return best
+
+
+def build_lods(mesh, levels):
+    """
+    Build one decimated mesh per requested level.
+    Each level is a dict with targetTriangles and/or maxError; a triangle budget wins if both are set.
+    """
+    if len(mesh.faces) == 0:
+        return [mesh for _ in levels]
+
+    lods = []
+    for level in levels:
+        if level.get("targetTriangles") is not None:
+            lod_mesh = decimate_to_triangles(mesh, level["targetTriangles"])
+        else:
+            lod_mesh = decimate_to_error(mesh, level["maxError"])
+        lods.append(lod_mesh)
+    return lods
@@ -3,152 +3,239 @@ CAD Converter API - Main application
 Authors: Josh Ayokhai & River
 GitHub: https://github.com/ajokhai/cad-converter
 """
-from fastapi import FastAPI, HTTPException
+import asyncio
+import base64
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import httpx
-import tempfile
-import os
-
-from app.models import ConversionRequest, BatchConversionRequest
-from app.metadata import extract_step_metadata, get_step_text_content
-from app.converter import (
-    convert_step_to_stl,
-    convert_stl_to_gltf,
-    calculate_dimensions,
-    is_cad_available
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
+import json
+
+from pydantic import ValidationError
+
+from app.models import (
+    ConversionRequest,
+    UploadConversionRequest,
+    BatchOptions,
+    BatchConversionRequest,
+    FileToProcess
+)
+from app.converter import is_cad_available, glb_with_extras
+from app.workers import (
+    start_worker_pool,
+    shutdown_worker_pool,
+    workers_ready,
+    warmup_seconds,
+    worker_stats,
+    WorkerTimeoutError
 )
-from app.ai_analysis import analyze_file_with_ai, generate_bom_from_batch
+from app.http_clients import start_http_clients, close_http_clients
+from app.download import FileTooLargeError
+from app.upload import receive_upload, discard_uploads, file_type_for, UploadError
+from app.artifacts import artifact_response, ARTIFACT_ROUTE
+from app.pipeline import (
+    convert_file,
+    extract_file_metadata,
+    convert_local_file,
+    extract_local_metadata,
+    run_batch,
+    stream_batch
+)
+from app.jobs import start_job_runner, stop_job_runner, get_job_runner, job_status
+from app.metrics import render_metrics, process_uptime, STARTUP_SECONDS
 from app.config import (
     MAX_FILE_SIZE_MB,
-    MAX_FILE_SIZE,
     CORS_ORIGINS,
     SUPPORTED_FORMATS,
+    OUTPUT_FORMATS,
+    MESH_ENCODINGS,
+    MAX_LOD_LEVELS,
+    TESSELLATION_QUALITY,
     SUPPORTED_AI_MODELS,
-    SITE_URL,
     PROJECT_AUTHORS,
     GITHUB_USERNAME,
-    GITHUB_REPO,
-    DOWNLOAD_TIMEOUT,
-    AI_TIMEOUT
+    GITHUB_REPO
 )
 
+
+# Seconds from process start until the app could serve requests
+startup_seconds = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start conversion workers, HTTP client pools and the job runner with the app.
+    Workers import the CAD stack in the background; /ready reports when they are warm.
+    """
+    global startup_seconds
+    start_worker_pool()
+    start_http_clients()
+    start_job_runner()
+    startup_seconds = process_uptime()
+    if startup_seconds is not None:
+        STARTUP_SECONDS.set(round(startup_seconds, 3), phase="app")
+    yield
+    await stop_job_runner()
+    await close_http_clients()
+    shutdown_worker_pool()
+
+
 app = FastAPI(
     title="CAD Converter API",
     description=f"Convert CAD files and generate BOMs with AI | Authors: {PROJECT_AUTHORS}",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
-    allow_methods=["POST", "GET"],
+    allow_methods=["POST", "GET", "HEAD"],
     allow_headers=["*"],
+    # Lets browser code read the headers used for caching and partial downloads
+    expose_headers=["ETag", "Content-Range", "Accept-Ranges", "Content-Length"],
 )
 
 
+def validate_conversion_options(request):
+    """Reject unsupported output options before any file is downloaded"""
+    if request.outputFormat not in OUTPUT_FORMATS:
+        raise HTTPException(400, f"Output format '{request.outputFormat}' not supported")
+    if request.meshEncoding is not None:
+        if request.meshEncoding not in MESH_ENCODINGS:
+            raise HTTPException(400, f"Mesh encoding '{request.meshEncoding}' not supported")
+        if request.assembly:
+            raise HTTPException(400, "Mesh encodings are not supported in assembly mode")
+    
+    if getattr(request, "binaryResponse", False):
+        if request.outputFormat != "glb":
+            raise HTTPException(400, "binaryResponse needs outputFormat 'glb'")
+        if request.lods or request.storeArtifacts:
+            raise HTTPException(400, "binaryResponse can't be combined with lods or storeArtifacts")
+    
+    if request.quality is not None and request.quality not in TESSELLATION_QUALITY:
+        raise HTTPException(400, f"Quality '{request.quality}' not supported")
+    if (request.linearDeflection is not None and request.linearDeflection <= 0) or \
+            (request.angularDeflection is not None and request.angularDeflection <= 0):
+        raise HTTPException(400, "linearDeflection and angularDeflection must be positive")
+    
+    if request.lods:
+        if request.assembly:
+            raise HTTPException(400, "LOD levels are not supported in assembly mode")
+        if len(request.lods) > MAX_LOD_LEVELS:
+            raise HTTPException(400, f"At most {MAX_LOD_LEVELS} LOD levels can be requested")
+        for level in request.lods:
+            if level.targetTriangles is None and level.maxError is None:
+                raise HTTPException(400, "Each LOD level needs targetTriangles or maxError")
+            if (level.targetTriangles is not None and level.targetTriangles <= 0) or \
+                    (level.maxError is not None and level.maxError <= 0):
+                raise HTTPException(400, "LOD targetTriangles and maxError must be positive")
+
+
+def conversion_response(request, result):
+    """
+    The conversion result as JSON or, with binaryResponse, as the raw GLB
+    with the rest of the result in its extras under "cadConverter"
+    """
+    if not request.binaryResponse:
+        return result
+    glb = base64.b64decode(result.pop("glb"))
+    return Response(glb_with_extras(glb, {"cadConverter": result}), media_type="model/gltf-binary")
+
+
+async def cancel_on_disconnect(http_request, awaitable):
+    """
+    Await the request's work, cancelling it (queued and running conversions
+    included) if the client disconnects first. The request body must already
+    have been read.
+    """
+    task = asyncio.ensure_future(awaitable)
+    
+    async def watch():
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+        task.cancel()
+    
+    watcher = asyncio.ensure_future(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not watcher.done():
+            raise
+        # Nobody is left to read this
+        raise HTTPException(499, "Client closed request")
+    finally:
+        watcher.cancel()
+
+
 @app.get("/health")
 async def health():
-    """Health check endpoint"""
+    """Liveness check: answers as soon as the app is up, before the CAD stack is warm"""
     return {
         "status": "ok",
         "cadLibraries": is_cad_available(),
         "maxFileSizeMB": MAX_FILE_SIZE_MB,
+        "startupSeconds": startup_seconds,
         "authors": PROJECT_AUTHORS,
         "repository": f"https://github.com/{GITHUB_USERNAME}/{GITHUB_REPO}"
     }
 
 
+@app.get("/ready")
+async def ready():
+    """Readiness check: 200 once conversion workers have loaded the CAD stack, 503 until then"""
+    is_ready = workers_ready()
+    return JSONResponse(
+        {
+            "ready": is_ready,
+            "cadLibraries": is_cad_available(),
+            "startupSeconds": startup_seconds,
+            "warmupSeconds": warmup_seconds(),
+            "workers": worker_stats()
+        },
+        status_code=200 if is_ready else 503
+    )
+
+
 @app.get("/api/limits")
 async def get_limits():
     """Get service limits and capabilities"""
     return {
         "maxFileSizeMB": MAX_FILE_SIZE_MB,
         "supportedFormats": SUPPORTED_FORMATS,
+        "outputFormats": OUTPUT_FORMATS,
+        "meshEncodings": MESH_ENCODINGS,
+        "maxLodLevels": MAX_LOD_LEVELS,
+        "qualityTiers": TESSELLATION_QUALITY,
         "supportedAIModels": SUPPORTED_AI_MODELS
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Stage latencies, throughput counters and in-flight gauges in Prometheus format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/api/convert")
-async def convert_cad(request: ConversionRequest):
+async def convert_cad(request: ConversionRequest, http_request: Request):
     """Convert single CAD file with optional AI analysis"""
     if not is_cad_available():
         raise HTTPException(500, "CAD libraries not installed")
     
     try:
-        # Download file
-        async with httpx.AsyncClient() as client:
-            head_response = await client.head(request.fileUrl, timeout=10.0)
-            content_length = head_response.headers.get('content-length')
-            
-            if content_length and int(content_length) > MAX_FILE_SIZE:
-                file_size_mb = int(content_length) / 1024 / 1024
-                raise HTTPException(413, f"File size ({file_size_mb:.1f}MB) exceeds limit")
-            
-            response = await client.get(request.fileUrl, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True)
-            response.raise_for_status()
-            file_content = response.content
-        
-        with tempfile.NamedTemporaryFile(suffix=f".{request.fileType}", delete=False) as tmp_input:
-            tmp_input.write(file_content)
-            input_path = tmp_input.name
+        if request.fileType.lower() not in ["step", "stp", "stl"]:
+            raise HTTPException(400, f"File type '{request.fileType}' not supported")
+        validate_conversion_options(request)
         
-        stl_path = input_path.replace(f".{request.fileType}", ".stl")
-        gltf_path = input_path.replace(f".{request.fileType}", ".gltf")
+        result = await cancel_on_disconnect(http_request, convert_file(request))
+        return conversion_response(request, result)
         
-        try:
-            # Extract metadata
-            metadata = extract_step_metadata(input_path)
-            step_content = get_step_text_content(input_path)
-            
-            # Convert to 3D
-            if request.fileType.lower() in ["step", "stp"]:
-                convert_step_to_stl(input_path, stl_path)
-            elif request.fileType.lower() == "stl":
-                import shutil
-                shutil.copy(input_path, stl_path)
-            else:
-                raise HTTPException(400, f"File type '{request.fileType}' not supported")
-            
-            # Calculate dimensions and convert to glTF
-            dimensions = calculate_dimensions(stl_path)
-            gltf_json = convert_stl_to_gltf(stl_path, gltf_path)
-            
-            response_data = {
-                "success": True,
-                "gltf": gltf_json,
-                "metadata": metadata,
-                "dimensions": dimensions,
-                "filename": os.path.basename(request.fileUrl)
-            }
-            
-            # AI Analysis if API key provided
-            if request.apiKey:
-                file_data = {
-                    "filename": os.path.basename(request.fileUrl),
-                    "file_type": request.fileType,
-                    "metadata": metadata,
-                    "dimensions": dimensions,
-                    "step_content": step_content
-                }
-                
-                ai_analysis = await analyze_file_with_ai(
-                    file_data,
-                    request.apiKey,
-                    request.aiModel,
-                    SITE_URL
-                )
-                response_data["ai_analysis"] = ai_analysis
-            
-            return response_data
-            
-        finally:
-            for path in [input_path, stl_path, gltf_path]:
-                if os.path.exists(path):
-                    try:
-                        os.unlink(path)
-                    except:
-                        pass
-                    
+    except FileTooLargeError as e:
+        raise HTTPException(413, str(e))
+    except WorkerTimeoutError as e:
+        raise HTTPException(504, str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -156,160 +243,250 @@ async def convert_cad(request: ConversionRequest):
 
 
 @app.post("/api/batch-convert")
-async def batch_convert_cad(request: BatchConversionRequest):
+async def batch_convert_cad(request: BatchConversionRequest, http_request: Request):
     """Process multiple CAD files and optionally generate BOM"""
     if not is_cad_available():
         raise HTTPException(500, "CAD libraries not installed")
+    validate_conversion_options(request)
     
-    results = []
-    files_data = []
+    return await batch_response(request, http_request)
+
+
+async def batch_response(request, http_request, uploads=None):
+    """
+    Run a batch as one JSON response or as a stream, per request.stream.
+    Either way, the batch is cancelled if the client disconnects.
+    """
+    if request.stream not in (None, "ndjson", "sse"):
+        raise HTTPException(400, f"Stream format '{request.stream}' not supported")
     
-    for file_req in request.files:
+    if request.stream is None:
         try:
-            # Download file
-            async with httpx.AsyncClient() as client:
-                response = await client.get(file_req.fileUrl, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True)
-                response.raise_for_status()
-                file_content = response.content
-            
-            with tempfile.NamedTemporaryFile(suffix=f".{file_req.fileType}", delete=False) as tmp_input:
-                tmp_input.write(file_content)
-                input_path = tmp_input.name
-            
-            stl_path = input_path.replace(f".{file_req.fileType}", ".stl")
-            gltf_path = input_path.replace(f".{file_req.fileType}", ".gltf")
-            
-            try:
-                file_result = {
-                    "filename": file_req.fileName or os.path.basename(file_req.fileUrl),
-                    "file_type": file_req.fileType,
-                    "success": True
-                }
-                
-                # Extract metadata
-                step_content = None
-                if request.extractMetadata:
-                    metadata = extract_step_metadata(input_path)
-                    step_content = get_step_text_content(input_path)
-                    file_result["metadata"] = metadata
-                
-                # Generate preview
-                if request.generatePreview:
-                    if file_req.fileType.lower() in ["step", "stp"]:
-                        convert_step_to_stl(input_path, stl_path)
-                    elif file_req.fileType.lower() == "stl":
-                        import shutil
-                        shutil.copy(input_path, stl_path)
-                    
-                    dimensions = calculate_dimensions(stl_path)
-                    gltf_json = convert_stl_to_gltf(stl_path, gltf_path)
-                    
-                    file_result["dimensions"] = dimensions
-                    file_result["gltf"] = gltf_json
-                
-                # Collect for AI analysis
-                if request.apiKey:
-                    file_data = {
-                        "filename": file_result["filename"],
-                        "file_type": file_result["file_type"],
-                        "metadata": file_result.get("metadata", {}),
-                        "dimensions": file_result.get("dimensions", {}),
-                        "step_content": step_content
-                    }
-                    files_data.append(file_data)
-                    
-                    # Individual AI analysis
-                    ai_analysis = await analyze_file_with_ai(
-                        file_data,
-                        request.apiKey,
-                        request.aiModel,
-                        SITE_URL
-                    )
-                    file_result["ai_analysis"] = ai_analysis
-                
-                results.append(file_result)
-                
-            finally:
-                for path in [input_path, stl_path, gltf_path]:
-                    if os.path.exists(path):
-                        try:
-                            os.unlink(path)
-                        except:
-                            pass
-                            
-        except Exception as e:
-            results.append({
-                "filename": file_req.fileName or os.path.basename(file_req.fileUrl),
-                "success": False,
-                "error": str(e)
-            })
+            return await cancel_on_disconnect(
+                http_request, run_batch(request, uploads=[u.file for u in uploads] if uploads else None)
+            )
+        finally:
+            if uploads:
+                discard_uploads(uploads)
     
-    response_data = {
-        "success": True,
-        "total_files": len(request.files),
-        "processed": len([r for r in results if r.get("success")]),
-        "failed": len([r for r in results if not r.get("success")]),
-        "files": results
-    }
+    async def records():
+        # The stream outlives this request handler, so it owns the uploads
+        try:
+            async for record in stream_batch(request, uploads=[u.file for u in uploads] if uploads else None):
+                yield record
+        finally:
+            if uploads:
+                discard_uploads(uploads)
     
-    # Generate BOM if requested
-    if request.generateBOM and request.apiKey and files_data:
-        bom = await generate_bom_from_batch(
-            files_data,
-            request.apiKey,
-            request.aiModel,
-            SITE_URL
+    if request.stream == "ndjson":
+        return StreamingResponse(
+            (json.dumps(record) + "\n" async for record in records()),
+            media_type="application/x-ndjson"
         )
-        response_data["bom"] = bom
-    
-    return response_data
+    return StreamingResponse(
+        (f"event: {record['type']}\ndata: {json.dumps(record)}\n\n" async for record in records()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.post("/api/metadata")
-async def extract_metadata_only(request: ConversionRequest):
+async def extract_metadata_only(request: ConversionRequest, http_request: Request):
     """Extract BOM metadata without 3D conversion (faster)"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(request.fileUrl, timeout=DOWNLOAD_TIMEOUT, follow_redirects=True)
-            response.raise_for_status()
-            file_content = response.content
+        return await cancel_on_disconnect(http_request, extract_file_metadata(request))
+    
+    except FileTooLargeError as e:
+        raise HTTPException(413, str(e))
+    except WorkerTimeoutError as e:
+        raise HTTPException(504, str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Metadata extraction failed: {str(e)}")
+
+
+def upload_options(model, options):
+    """Validate upload options against a request model; errors look like FastAPI's own 422s"""
+    try:
+        return model(**options)
+    except ValidationError as e:
+        raise HTTPException(422, json.loads(e.json()))
+
+
+def uploaded_file_type(upload, file_type=None):
+    """File type of an upload (explicit, or from its name), rejecting unsupported types"""
+    file_type = file_type_for(upload.filename, file_type)
+    if file_type not in ["step", "stp", "stl"]:
+        raise HTTPException(400, f"File type '{file_type}' not supported for '{upload.filename}'")
+    return file_type
+
+
+@app.post("/api/upload/convert")
+async def upload_convert_cad(request: Request):
+    """
+    Convert a CAD file sent in the request body instead of fetched from a URL.
+    Accepts multipart/form-data (one file part, JSON 'options' field) or the raw file.
+    """
+    if not is_cad_available():
+        raise HTTPException(500, "CAD libraries not installed")
+    
+    files = []
+    try:
+        options, files = await receive_upload(request, max_files=1)
+        upload_request = upload_options(UploadConversionRequest, options)
+        if len(files) != 1:
+            raise HTTPException(400, "Upload exactly one file")
+        upload = files[0]
+        filename = upload_request.fileName or upload.filename
+        file_type = uploaded_file_type(upload, upload_request.fileType)
+        validate_conversion_options(upload_request)
         
-        with tempfile.NamedTemporaryFile(suffix=f".{request.fileType}", delete=False) as tmp_input:
-            tmp_input.write(file_content)
-            input_path = tmp_input.name
+        files = []  # the pipeline deletes the file
+        result = await cancel_on_disconnect(
+            request, convert_local_file(upload.file, file_type, filename, upload_request)
+        )
+        return conversion_response(upload_request, result)
+    
+    except FileTooLargeError as e:
+        raise HTTPException(413, str(e))
+    except UploadError as e:
+        raise HTTPException(400, str(e))
+    except WorkerTimeoutError as e:
+        raise HTTPException(504, str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Conversion failed: {str(e)}")
+    finally:
+        discard_uploads(files)
+
+
+@app.post("/api/upload/batch-convert")
+async def upload_batch_convert_cad(request: Request):
+    """
+    Process several uploaded CAD files (multipart/form-data, one part per file,
+    batch options as a JSON 'options' field) and optionally generate a BOM
+    """
+    if not is_cad_available():
+        raise HTTPException(500, "CAD libraries not installed")
+    
+    files = []
+    try:
+        options, files = await receive_upload(request)
+        batch_options = upload_options(BatchOptions, options)
+        if not files:
+            raise HTTPException(400, "No files uploaded")
+        batch_request = BatchConversionRequest(
+            **batch_options.model_dump(),
+            # Uploaded files are already on disk; there is nothing to fetch
+            files=[
+                FileToProcess(fileUrl="", fileType=uploaded_file_type(upload), fileName=upload.filename)
+                for upload in files
+            ]
+        )
+        validate_conversion_options(batch_request)
         
-        try:
-            metadata = extract_step_metadata(input_path)
-            step_content = get_step_text_content(input_path)
-            
-            response_data = {
-                "success": True,
-                "metadata": metadata,
-                "filename": os.path.basename(request.fileUrl)
-            }
-            
-            # AI Analysis if API key provided
-            if request.apiKey:
-                file_data = {
-                    "filename": os.path.basename(request.fileUrl),
-                    "file_type": request.fileType,
-                    "metadata": metadata,
-                    "step_content": step_content
-                }
-                
-                ai_analysis = await analyze_file_with_ai(
-                    file_data,
-                    request.apiKey,
-                    request.aiModel,
-                    SITE_URL
-                )
-                response_data["ai_analysis"] = ai_analysis
-            
-            return response_data
-            
-        finally:
-            if os.path.exists(input_path):
-                os.unlink(input_path)
-                
+        response = await batch_response(batch_request, request, files)
+        files = []  # batch_response (or its stream) deletes the files
+        return response
+    
+    except FileTooLargeError as e:
+        raise HTTPException(413, str(e))
+    except UploadError as e:
+        raise HTTPException(400, str(e))
+    finally:
+        discard_uploads(files)
+
+
+@app.post("/api/upload/metadata")
+async def upload_extract_metadata(request: Request):
+    """Extract BOM metadata from an uploaded file without 3D conversion"""
+    files = []
+    try:
+        options, files = await receive_upload(request, max_files=1)
+        upload_request = upload_options(UploadConversionRequest, options)
+        if len(files) != 1:
+            raise HTTPException(400, "Upload exactly one file")
+        upload = files[0]
+        filename = upload_request.fileName or upload.filename
+        file_type = uploaded_file_type(upload, upload_request.fileType)
+        
+        files = []  # the pipeline deletes the file
+        return await cancel_on_disconnect(
+            request, extract_local_metadata(upload.file, file_type, filename, upload_request)
+        )
+    
+    except FileTooLargeError as e:
+        raise HTTPException(413, str(e))
+    except UploadError as e:
+        raise HTTPException(400, str(e))
+    except WorkerTimeoutError as e:
+        raise HTTPException(504, str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, f"Metadata extraction failed: {str(e)}")
+    finally:
+        discard_uploads(files)
+
+
+@app.post("/api/jobs/convert", status_code=202)
+async def submit_convert_job(request: ConversionRequest):
+    """Queue a single-file conversion and return its job id immediately"""
+    if not is_cad_available():
+        raise HTTPException(500, "CAD libraries not installed")
+    if request.fileType.lower() not in ["step", "stp", "stl"]:
+        raise HTTPException(400, f"File type '{request.fileType}' not supported")
+    validate_conversion_options(request)
+    if request.binaryResponse:
+        raise HTTPException(400, "binaryResponse is not supported for jobs; use storeArtifacts")
+    
+    job_id = await get_job_runner().submit("convert", request)
+    return {"jobId": job_id, "status": "queued", "statusUrl": f"/api/jobs/{job_id}"}
+
+
+@app.post("/api/jobs/batch-convert", status_code=202)
+async def submit_batch_job(request: BatchConversionRequest):
+    """Queue a batch conversion and return its job id immediately"""
+    if not is_cad_available():
+        raise HTTPException(500, "CAD libraries not installed")
+    validate_conversion_options(request)
+    
+    job_id = await get_job_runner().submit("batch-convert", request)
+    return {"jobId": job_id, "status": "queued", "statusUrl": f"/api/jobs/{job_id}"}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status and progress"""
+    job = await get_job_runner().get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found or expired")
+    return job_status(job)
+
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """Result of a finished job; 202 with the job status while it is still pending"""
+    job = await get_job_runner().get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found or expired")
+    
+    if job["status"] in ("queued", "running"):
+        return JSONResponse(job_status(job), status_code=202)
+    if job["status"] == "failed":
+        return {"success": False, "jobId": job_id, "error": job["error"]}
+    return json.loads(job["result"])
+
+
+@app.api_route(ARTIFACT_ROUTE + "/{name}", methods=["GET", "HEAD"])
+async def get_artifact(name: str, request: Request):
+    """
+    A stored mesh (see storeArtifacts). Supports If-None-Match, Range and
+    gzip/br; content-addressed, so responses may be cached indefinitely.
+    """
+    response = artifact_response(request, name)
+    if response is None:
+        raise HTTPException(404, "Artifact not found or expired")
+    return response
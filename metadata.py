@@ -3,10 +3,314 @@ CAD metadata extraction utilities
 Authors: Josh Ayokhai & River
 """
 import re
+from collections import Counter
+
+# Bytes read per chunk while scanning a STEP file
+_CHUNK_SIZE = 1024 * 1024
+
+# Give up on a file once this much text has not formed a complete statement
+_MAX_STATEMENT_SIZE = 64 * 1024 * 1024
+
+# One complete ISO 10303-21 statement: anything up to a ';' that is not inside
+# a string or comment. Possessive quantifiers keep failures (an incomplete
+# statement at the end of a chunk) linear instead of backtracking.
+_STATEMENT = re.compile(r"(?:[^;'/]++|'(?:[^']|'')*+'|/\*.*?\*/|/)*+;", re.S)
+
+_ENTITY_HEAD = re.compile(r"\s*#(\d+)\s*=\s*([A-Za-z0-9_]*)")
+_KEYWORD_HEAD = re.compile(r"\s*([A-Za-z0-9_-]+)")
+
+_TOKEN = re.compile(
+    r"'(?:[^']|'')*'"            # string
+    r"|#\d+"                     # entity reference
+    r"|\.[A-Za-z0-9_]+\."        # enumeration / boolean
+    r"|[A-Za-z_][A-Za-z0-9_]*"   # typed parameter name
+    r"|[-+]?[0-9][0-9.Ee+-]*"    # number
+    r"|[$*(),]",
+    re.S
+)
+
+_UNICODE_ESCAPE = re.compile(r"\\X2\\((?:[0-9A-Fa-f]{4})+)\\X0\\|\\X\\([0-9A-Fa-f]{2})")
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}")
+_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+
+# What may come before the ISO-10303-21 magic: a UTF-8 byte order mark (read
+# as latin-1), whitespace and comments
+_PREAMBLE = re.compile(r"(?:\xef\xbb\xbf|\s+|/\*.*?\*/)*", re.S)
+_MAGIC = "ISO-10303-21"
+
+# Unit definitions are complex entities, e.g. (LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.))
+_UNIT_KIND = re.compile(r"\b(LENGTH|PLANE_ANGLE|SOLID_ANGLE|MASS)_UNIT\s*\(", re.I)
+_SI_UNIT = re.compile(r"\bSI_UNIT\s*\(\s*(?:\.([A-Z]+)\.|[$*])\s*,\s*\.([A-Z_]+)\.\s*\)", re.I)
+_CONVERSION_UNIT = re.compile(r"\bCONVERSION_BASED_UNIT\s*\(\s*'((?:[^']|'')*)'", re.I)
+
+# Entities kept in the index; everything else is only counted
+_INDEXED_ENTITIES = {
+    "PRODUCT",
+    "PRODUCT_DEFINITION_FORMATION",
+    "PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE",
+    "PRODUCT_DEFINITION",
+    "NEXT_ASSEMBLY_USAGE_OCCURRENCE",
+    "MATERIAL_DESIGNATION",
+    "DESCRIPTIVE_REPRESENTATION_ITEM"
+}
+
+# Assembly trees deeper than this are cut off (guards against cyclic files)
+_MAX_TREE_DEPTH = 32
+
+
+def _decode_string(token):
+    """Decode a quoted STEP string, including \\X2\\ and \\X\\ escapes"""
+    text = token[1:-1].replace("''", "'")
+    if "\\X" not in text:
+        return text
+
+    def replace(match):
+        if match.group(1):
+            hex_text = match.group(1)
+            return "".join(chr(int(hex_text[i:i + 4], 16)) for i in range(0, len(hex_text), 4))
+        return chr(int(match.group(2), 16))
+
+    return _UNICODE_ESCAPE.sub(replace, text)
+
+
+def parse_parameters(text):
+    """
+    Parse the parameter list of a STEP entity, e.g. "('a',#12,(1.,2.),$)".
+    Strings are decoded, references stay as '#12', unset values become None,
+    and nested lists (including typed parameters) become Python lists.
+    """
+    stack = [[]]
+    for match in _TOKEN.finditer(text):
+        token = match.group()
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        elif token == ",":
+            continue
+        elif token[0] == "'":
+            stack[-1].append(_decode_string(token))
+        elif token in ("$", "*"):
+            stack[-1].append(None)
+        else:
+            # Typed parameters like LENGTH_MEASURE(1.) keep only their value list
+            if token[0].isalpha() and match.end() < len(text) and text[match.end()] == "(":
+                continue
+            stack[-1].append(token)
+
+    params = stack[0]
+    # The outer parentheses of the entity wrap everything
+    if len(params) == 1 and isinstance(params[0], list):
+        return params[0]
+    return params
+
+
+def _parameter_text(statement, start):
+    """The parenthesised parameter list of a statement, starting at start"""
+    end = statement.rfind(")")
+    return statement[start:end + 1] if end >= start else ""
+
+
+def _iter_statements(file_path):
+    """Yield each complete statement of a STEP file, reading it in fixed-size chunks"""
+    with open(file_path, "r", encoding="latin-1") as f:
+        buffer = ""
+        first = True
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+
+            if first:
+                buffer = buffer[_PREAMBLE.match(buffer).end():]
+                if not buffer.startswith(_MAGIC):
+                    if buffer.startswith("/*") and len(buffer) <= _MAX_STATEMENT_SIZE:
+                        continue  # a comment that ends in a later chunk
+                    if len(buffer) >= len(_MAGIC) or not _MAGIC.startswith(buffer):
+                        return  # Not a STEP physical file
+                    continue
+                first = False
+
+            # Anchored at each statement start, so an incomplete statement at
+            # the end is tried once per chunk rather than from every offset
+            pos = 0
+            while True:
+                match = _STATEMENT.match(buffer, pos)
+                if match is None:
+                    break  # the rest is an incomplete statement
+                pos = match.end()
+                yield match.group()
+
+            buffer = buffer[pos:]
+            if len(buffer) > _MAX_STATEMENT_SIZE:
+                raise ValueError("STEP statement too large or file is malformed")
+
+
+def _unit(statement):
+    """(kind, name) of a unit definition, e.g. ("length", "millimetre"), or None"""
+    kind = _UNIT_KIND.search(statement)
+    if not kind:
+        return None
+    conversion = _CONVERSION_UNIT.search(statement)
+    if conversion:
+        name = conversion.group(1).replace("''", "'").lower()
+    else:
+        si_unit = _SI_UNIT.search(statement)
+        if not si_unit:
+            return None
+        prefix, base = si_unit.groups()
+        name = ((prefix or "") + base).lower()
+    return kind.group(1).lower(), name
+
+
+def scan_step_file(file_path):
+    """
+    Walk a STEP file once with bounded memory.
+    Returns the parsed header entities, an index of the product, assembly and
+    property entities by id, a count of every entity type in the DATA section,
+    and the first length, angle and mass unit defined.
+    """
+    header = {}
+    entities = {}
+    entity_counts = Counter()
+    units = {}
+    section = None
+
+    for statement in _iter_statements(file_path):
+        if "/*" in statement:
+            statement = _COMMENT.sub("", statement)
+
+        entity = _ENTITY_HEAD.match(statement)
+        if entity:
+            type_name = entity.group(2).upper() or "COMPLEX_ENTITY"
+            entity_counts[type_name] += 1
+            if type_name in _INDEXED_ENTITIES:
+                entities[int(entity.group(1))] = (
+                    type_name,
+                    parse_parameters(_parameter_text(statement, entity.end()))
+                )
+            elif type_name == "COMPLEX_ENTITY" and "UNIT" in statement:
+                unit = _unit(statement)
+                if unit and unit[0] not in units:
+                    units[unit[0]] = unit[1]
+            continue
+
+        keyword = _KEYWORD_HEAD.match(statement)
+        if not keyword:
+            continue
+        name = keyword.group(1).upper()
+        if name in ("HEADER", "DATA"):
+            section = name
+        elif name == "ENDSEC":
+            section = None
+        elif section == "HEADER" and "(" in statement:
+            header[name] = parse_parameters(_parameter_text(statement, keyword.end()))
+
+    return {
+        "header": header,
+        "entities": entities,
+        "entity_counts": dict(entity_counts),
+        "units": units
+    }
+
+
+def _param(params, index):
+    return params[index] if len(params) > index else None
+
+
+def _first_string(value):
+    """First string in a value that may be a (possibly nested) list"""
+    while isinstance(value, list):
+        if not value:
+            return None
+        value = value[0]
+    return value
+
+
+def _ref(value):
+    if isinstance(value, str) and value.startswith("#"):
+        return int(value[1:])
+    return None
+
+
+def _collect_products(entities):
+    """Map each product definition id to the product it describes"""
+    products = {}
+    for entity_id, (type_name, params) in entities.items():
+        if type_name == "PRODUCT":
+            products[entity_id] = {
+                "part_number": _param(params, 0),
+                "name": _param(params, 1),
+                "description": _param(params, 2) or None
+            }
+
+    definitions = {}
+    for entity_id, (type_name, params) in entities.items():
+        if type_name != "PRODUCT_DEFINITION":
+            continue
+        formation = entities.get(_ref(_param(params, 2)))
+        if not formation or not formation[0].startswith("PRODUCT_DEFINITION_FORMATION"):
+            continue
+        product = products.get(_ref(_param(formation[1], 2)))
+        if product:
+            definitions[entity_id] = product
+
+    return products, definitions
+
+
+def _build_assembly_tree(entities, definitions):
+    """Build the parts tree from NEXT_ASSEMBLY_USAGE_OCCURRENCE links"""
+    children = {}
+    child_ids = set()
+    for type_name, params in entities.values():
+        if type_name != "NEXT_ASSEMBLY_USAGE_OCCURRENCE":
+            continue
+        parent = _ref(_param(params, 3))
+        child = _ref(_param(params, 4))
+        if parent in definitions and child in definitions:
+            children.setdefault(parent, Counter())[child] += 1
+            child_ids.add(child)
+
+    if not children:
+        return []
+
+    def build(definition_id, quantity, depth):
+        product = definitions[definition_id]
+        node = {
+            "part_number": product["part_number"],
+            "name": product["name"],
+            "quantity": quantity
+        }
+        if depth < _MAX_TREE_DEPTH and definition_id in children:
+            node["children"] = [
+                build(child_id, count, depth + 1)
+                for child_id, count in children[definition_id].items()
+            ]
+        return node
+
+    roots = [definition_id for definition_id in children if definition_id not in child_ids]
+    return [build(root, 1, 0) for root in roots]
 
 
 def extract_step_metadata(file_path):
-    """Extract metadata from STEP file headers"""
+    """Extract metadata, products and the assembly tree from a STEP file"""
+    return extract_step_context(file_path)["metadata"]
+
+
+def extract_step_context(file_path):
+    """
+    Metadata (as extract_step_metadata) plus a summary of the file for AI
+    prompts: schema, originating system, units and entity type counts.
+    """
+    summary = {
+        'schema': None,
+        'originating_system': None,
+        'units': {},
+        'entity_counts': {}
+    }
     metadata = {
         'part_name': None,
         'part_number': None,
@@ -15,54 +319,70 @@ def extract_step_metadata(file_path):
         'description': None,
         'timestamp': None,
         'material': None,
-        'custom_properties': {}
+        'custom_properties': {},
+        'products': [],
+        'assembly': []
     }
-    
+
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read(10000)  # Read first 10KB for header info
-            
-            # Extract FILE_NAME entity
-            file_name_pattern = r"FILE_NAME\s*\(\s*'([^']*)'.*?\('([^']*)'\)\s*,\s*\('([^']*)'\)"
-            match = re.search(file_name_pattern, content)
-            if match:
-                metadata['part_name'] = match.group(1).strip("'")
-                metadata['author'] = match.group(2).strip("'")
-                metadata['organization'] = match.group(3).strip("'")
-            
-            # Extract FILE_DESCRIPTION
-            desc_pattern = r"FILE_DESCRIPTION\s*\(\s*\('([^']*)'\)"
-            desc_match = re.search(desc_pattern, content)
-            if desc_match:
-                metadata['description'] = desc_match.group(1)
-            
-            # Look for PRODUCT entities
-            product_pattern = r"PRODUCT\s*\(\s*'([^']*)'.*?'([^']*)'"
-            product_match = re.search(product_pattern, content)
-            if product_match:
-                if not metadata['part_number']:
-                    metadata['part_number'] = product_match.group(1)
-                if not metadata['part_name']:
-                    metadata['part_name'] = product_match.group(2)
-            
-            # Extract timestamp
-            timestamp_pattern = r"'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})'"
-            timestamp_match = re.search(timestamp_pattern, content)
-            if timestamp_match:
-                metadata['timestamp'] = timestamp_match.group(1)
-    
+        scan = scan_step_file(file_path)
+        header = scan["header"]
+        entities = scan["entities"]
+
+        # FILE_NAME(name, timestamp, (author), (organization), ...)
+        file_name = header.get("FILE_NAME")
+        if file_name:
+            metadata['part_name'] = _first_string(_param(file_name, 0)) or None
+            metadata['timestamp'] = _first_string(_param(file_name, 1)) or None
+            metadata['author'] = _first_string(_param(file_name, 2)) or None
+            metadata['organization'] = _first_string(_param(file_name, 3)) or None
+
+        # FILE_DESCRIPTION((description), implementation_level)
+        file_description = header.get("FILE_DESCRIPTION")
+        if file_description:
+            metadata['description'] = _first_string(_param(file_description, 0)) or None
+
+        # FILE_NAME(..., preprocessor_version, originating_system, authorization)
+        if file_name:
+            summary['originating_system'] = (
+                _first_string(_param(file_name, 5)) or _first_string(_param(file_name, 4)) or None
+            )
+
+        # FILE_SCHEMA(('AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }'))
+        file_schema = _first_string(header.get("FILE_SCHEMA"))
+        if isinstance(file_schema, str) and file_schema.split():
+            summary['schema'] = file_schema.split()[0]
+
+        summary['units'] = scan["units"]
+        summary['entity_counts'] = scan["entity_counts"]
+
+        if metadata['timestamp']:
+            timestamp = _TIMESTAMP.match(metadata['timestamp'])
+            metadata['timestamp'] = timestamp.group() if timestamp else None
+
+        products, definitions = _collect_products(entities)
+        metadata['products'] = list(products.values())
+        if metadata['products']:
+            first_product = metadata['products'][0]
+            metadata['part_number'] = first_product['part_number']
+            if not metadata['part_name']:
+                metadata['part_name'] = first_product['name']
+
+        metadata['assembly'] = _build_assembly_tree(entities, definitions)
+
+        # Materials and user-defined properties
+        for type_name, params in entities.values():
+            if type_name == "MATERIAL_DESIGNATION" and not metadata['material']:
+                metadata['material'] = _param(params, 0)
+            elif type_name == "DESCRIPTIVE_REPRESENTATION_ITEM":
+                name, value = _param(params, 0), _param(params, 1)
+                if isinstance(name, str) and isinstance(value, str) and name:
+                    metadata['custom_properties'][name] = value
+                    if not metadata['material'] and "material" in name.lower():
+                        metadata['material'] = value
+
     except Exception as e:
         print(f"Metadata extraction warning: {e}")
-    
-    return metadata
 
+    return {"metadata": metadata, "summary": summary}
 
-def get_step_text_content(file_path, max_chars=5000):
-    """Get text content from STEP file for AI analysis"""
-    try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read(max_chars)
-            return content
-    except Exception as e:
-        print(f"Error reading STEP content: {e}")
-        return None
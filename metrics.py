@@ -0,0 +1,256 @@
+"""
+Prometheus-format metrics for pipeline stages
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Stage durations range from a cached lookup to a multi-minute assembly tessellation
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Every metric registers itself here and is rendered by render_metrics()
+registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self, key, value):
+        counts, total = value
+        lines = [
+            f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+STAGE_DURATION = Histogram(
+    "cad_stage_duration_seconds",
+    "Time spent in each processing stage",
+    ["stage", "file_type", "outcome"]
+)
+STAGES_IN_FLIGHT = Gauge(
+    "cad_stage_in_flight",
+    "Stages currently running",
+    ["stage"]
+)
+DOWNLOAD_BYTES = Counter(
+    "cad_download_bytes_total",
+    "Bytes of CAD files downloaded",
+    ["file_type"]
+)
+TRIANGLES = Counter(
+    "cad_triangles_total",
+    "Triangles produced by tessellation",
+    ["file_type"]
+)
+CACHE_REQUESTS = Counter(
+    "cad_cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"]
+)
+WORKER_RSS_BYTES = Gauge(
+    "cad_worker_rss_bytes",
+    "Resident memory of each conversion worker after its last job",
+    ["worker"]
+)
+WORKER_JOBS = Counter(
+    "cad_worker_jobs_total",
+    "Jobs run by conversion workers, by outcome (success, error, crashed, timeout, cancelled)",
+    ["outcome"]
+)
+WORKER_RECYCLES = Counter(
+    "cad_worker_recycles_total",
+    "Conversion workers replaced, by reason (max_jobs, max_rss, crashed, timeout, cancelled)",
+    ["reason"]
+)
+STARTUP_SECONDS = Gauge(
+    "cad_startup_seconds",
+    "Seconds from process start until the app serves requests (app) and until conversion workers are warm (workers_warm)",
+    ["phase"]
+)
+
+
+class StageOutcome:
+    """Yielded by stage_timer; call fail() for a stage that returns its failure instead of raising"""
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+@contextmanager
+def stage_timer(stage, file_type="", timings=None):
+    """
+    Time a stage into the stage histogram (outcome success, error or cancelled)
+    and count it as in flight while it runs. If a timings dict is given, the
+    elapsed seconds are also added to timings[stage]. The stage is an error if
+    it raises or if the body calls fail() on the yielded StageOutcome.
+    """
+    STAGES_IN_FLIGHT.inc(stage=stage)
+    outcome = "error"
+    result = StageOutcome()
+    start = time.perf_counter()
+    try:
+        yield result
+        outcome = "error" if result.failed else "success"
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGES_IN_FLIGHT.dec(stage=stage)
+        STAGE_DURATION.observe(elapsed, stage=stage, file_type=file_type.lower(), outcome=outcome)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + elapsed, 6)
+
+
+# Called with each stage's name as stage_clock enters it; worker processes
+# use it to tell the pool which stage (and so which time limit) they are in
+_stage_listener = None
+
+
+def set_stage_listener(listener):
+    global _stage_listener
+    _stage_listener = listener
+
+
+@contextmanager
+def stage_clock(timings, stage):
+    """Time a stage into a timings dict only; for worker processes, whose metrics don't reach /metrics"""
+    if _stage_listener is not None:
+        _stage_listener(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round(timings.get(stage, 0) + time.perf_counter() - start, 6)
+
+
+def record_stage_timings(stage_timings, file_type, timings=None):
+    """Record successful stage timings measured elsewhere (e.g. in a worker process)"""
+    for stage, elapsed in stage_timings.items():
+        STAGE_DURATION.observe(elapsed, stage=stage, file_type=file_type.lower(), outcome="success")
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + elapsed, 6)
+
+
+def process_uptime():
+    """Seconds since this process was started (Linux), or None where that isn't available"""
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may itself contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        started = boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return max(0.0, time.time() - started)
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def resident_memory():
+    """This process's resident set size in bytes (current on Linux, peak elsewhere)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -6,23 +6,60 @@ from pydantic import BaseModel
 from typing import List, Optional
 
 
+class LODLevel(BaseModel):
+    targetTriangles: Optional[int] = None  # triangle budget for this level
+    maxError: Optional[float] = None  # or max vertex deviation in model units (mm)
+
+
 class FileToProcess(BaseModel):
     fileUrl: str
     fileType: str  # "step", "stp", "stl"
     fileName: Optional[str] = None
 
 
-class ConversionRequest(BaseModel):
-    fileUrl: str
-    fileType: str
+class ConversionOptions(BaseModel):
     aiModel: Optional[str] = "anthropic/claude-3.5-sonnet"
     apiKey: Optional[str] = None
+    outputFormat: str = "gltf"  # "gltf" (JSON, embedded buffers) or "glb" (base64 binary)
+    lods: Optional[List[LODLevel]] = None  # extra decimated previews
+    quality: Optional[str] = None  # tessellation tier: "draft", "standard" or "fine"
+    linearDeflection: Optional[float] = None  # overrides the tier's value
+    angularDeflection: Optional[float] = None  # overrides the tier's value
+    includeTimings: bool = False  # add per-stage timings (seconds) to the response
+    meshEncoding: Optional[str] = None  # "optimized" or "quantized" for smaller glTF/GLB output
+    storeArtifacts: bool = False  # return meshes as /api/artifacts URLs instead of inline
+    assembly: bool = False  # STEP: keep the part tree, one mesh per unique part
+    binaryResponse: bool = False  # "glb" only: reply with the GLB itself, the rest of the result in its extras
 
 
-class BatchConversionRequest(BaseModel):
-    files: List[FileToProcess]
+class ConversionRequest(ConversionOptions):
+    fileUrl: str
+    fileType: str
+
+
+class UploadConversionRequest(ConversionOptions):
+    fileType: Optional[str] = None  # defaults to the uploaded file's extension
+    fileName: Optional[str] = None  # defaults to the uploaded file's name
+
+
+class BatchOptions(BaseModel):
     aiModel: Optional[str] = "anthropic/claude-3.5-sonnet"
     apiKey: Optional[str] = None
     extractMetadata: bool = True
     generatePreview: bool = True
     generateBOM: bool = False
+    stream: Optional[str] = None  # "ndjson" or "sse" to stream each file's result as it finishes
+    deduplicate: bool = False  # Process identical parts once and report quantities
+    outputFormat: str = "gltf"
+    lods: Optional[List[LODLevel]] = None
+    quality: Optional[str] = None
+    linearDeflection: Optional[float] = None
+    angularDeflection: Optional[float] = None
+    includeTimings: bool = False
+    meshEncoding: Optional[str] = None
+    storeArtifacts: bool = False
+    assembly: bool = False
+
+
+class BatchConversionRequest(BatchOptions):
+    files: List[FileToProcess]
@@ -0,0 +1,726 @@
+"""
+File processing pipeline shared by the API endpoints
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import copy
+import itertools
+import os
+
+from app.metadata import extract_step_context
+from app.converter import convert_cad_file, file_properties, is_cad_available, saved_shape_path
+from app.workers import run_in_worker
+from app.cache import conversion_cache, cache_key
+from app.artifacts import artifact_store
+from app.ai_analysis import analyze_file_with_ai, generate_bom_from_batch
+from app.download import download_to_file, filename_from_url
+from app.metrics import stage_timer, record_stage_timings, DOWNLOAD_BYTES, TRIANGLES, CACHE_REQUESTS
+from app.config import (
+    SITE_URL,
+    TESSELLATION_QUALITY,
+    DEFAULT_TESSELLATION_QUALITY,
+    BATCH_DOWNLOAD_CONCURRENCY,
+    BATCH_CONVERT_CONCURRENCY,
+    BATCH_AI_CONCURRENCY,
+    BATCH_STREAM_IN_FLIGHT
+)
+
+
+async def get_file_metadata(input_path, file_hash, file_type="step", timings=None):
+    """Extract metadata and the STEP summary for AI prompts, reusing cached results for identical files"""
+    key = cache_key(file_hash, stage="metadata")
+    cached = await asyncio.to_thread(conversion_cache.get, key)
+    CACHE_REQUESTS.inc(cache="metadata", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached, "hit"
+
+    # The STEP scan walks the whole file, so it runs off the event loop
+    with stage_timer("metadata", file_type, timings):
+        context = await run_in_worker(extract_step_context, input_path)
+        entry = {"metadata": context["metadata"], "step_summary": context["summary"]}
+    await asyncio.to_thread(conversion_cache.put, key, entry)
+    return entry, "miss"
+
+
+async def get_file_properties(input_path, file_hash, file_type="step", timings=None, keep_shape=False):
+    """
+    Measure dimensions and mass properties without tessellating, reusing cached
+    results. keep_shape saves a STEP file's imported shape for its conversion.
+    """
+    key = cache_key(file_hash, stage="properties", file_type=file_type.lower())
+    cached = await asyncio.to_thread(conversion_cache.get, key)
+    CACHE_REQUESTS.inc(cache="properties", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached, "hit"
+
+    with stage_timer("measure", file_type, timings):
+        entry = await run_in_worker(file_properties, input_path, file_type, keep_shape)
+    record_stage_timings(entry.pop("timings", {}), file_type, timings)
+    await asyncio.to_thread(conversion_cache.put, key, entry)
+    return entry, "miss"
+
+
+def _artifact_names(conversion):
+    """Names of the stored artifacts a conversion result refers to"""
+    results = [conversion] + conversion.get("lods", [])
+    return [result["artifact"]["name"] for result in results if "artifact" in result]
+
+
+def lod_levels(lods):
+    """Plain-dict LOD levels from request models, so they can be sent to workers and hashed"""
+    return [level.model_dump() for level in lods] if lods else None
+
+
+def tessellation_params(request):
+    """Resolve a request's quality tier and explicit overrides into deflection values"""
+    tier = TESSELLATION_QUALITY[request.quality or DEFAULT_TESSELLATION_QUALITY]
+    linear = request.linearDeflection if request.linearDeflection is not None else tier["linearDeflection"]
+    angular = request.angularDeflection if request.angularDeflection is not None else tier["angularDeflection"]
+    return linear, angular
+
+
+async def get_file_conversion(
+    input_path,
+    file_type,
+    file_hash,
+    output_format="gltf",
+    lods=None,
+    tessellation=(0.1, 0.1),
+    timings=None,
+    assembly=False,
+    mesh_encoding=None,
+    store_artifacts=False
+):
+    """
+    Convert a file to glTF/GLB in a worker process, reusing cached results for identical files.
+    Stage timings of a fresh conversion are recorded, and added to timings if given.
+    A cached result whose stored artifacts have expired is converted again.
+    """
+    linear_deflection, angular_deflection = tessellation
+    key = cache_key(
+        file_hash,
+        stage="convert",
+        file_type=file_type.lower(),
+        output_format=output_format,
+        lods=lods,
+        linear_deflection=linear_deflection,
+        angular_deflection=angular_deflection,
+        assembly=assembly,
+        mesh_encoding=mesh_encoding,
+        store_artifacts=store_artifacts
+    )
+    cached = await asyncio.to_thread(conversion_cache.get, key)
+    if cached is not None and store_artifacts and \
+            not await asyncio.to_thread(artifact_store.refresh, _artifact_names(cached)):
+        cached = None
+    CACHE_REQUESTS.inc(cache="conversion", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached, "hit"
+
+    with stage_timer("convert", file_type, timings):
+        conversion = await run_in_worker(
+            convert_cad_file,
+            input_path,
+            file_type,
+            output_format,
+            lods,
+            linear_deflection,
+            angular_deflection,
+            assembly,
+            mesh_encoding,
+            store_artifacts
+        )
+    record_stage_timings(conversion.pop("timings", {}), file_type, timings)
+    TRIANGLES.inc(conversion["triangles"], file_type=file_type.lower())
+    await asyncio.to_thread(conversion_cache.put, key, conversion)
+    return conversion, "miss"
+
+
+def _remove(path):
+    if os.path.exists(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+async def fetch_file(url, file_type, timings=None):
+    """Download a file to disk, recording the download stage"""
+    with stage_timer("download", file_type, timings):
+        download = await download_to_file(url, f".{file_type}")
+    DOWNLOAD_BYTES.inc(download.size, file_type=file_type.lower())
+    return download
+
+
+async def convert_file(request, on_stage=None):
+    """
+    Download, convert and optionally analyze a single file.
+    on_stage(name) is called as each stage starts. Errors are raised to the caller.
+    """
+    if on_stage:
+        on_stage("downloading")
+    timings = {}
+    download = await fetch_file(request.fileUrl, request.fileType, timings)
+    return await convert_local_file(
+        download, request.fileType, filename_from_url(request.fileUrl), request, on_stage, timings
+    )
+
+
+async def convert_local_file(source, file_type, filename, options, on_stage=None, timings=None):
+    """
+    Convert and optionally analyze a file that is already on disk (a DownloadedFile),
+    using the conversion options of a request. The file is deleted afterwards.
+    """
+    def stage(name):
+        if on_stage:
+            on_stage(name)
+
+    timings = {} if timings is None else timings
+    input_path = source.path
+    file_hash = source.sha256
+
+    try:
+        # Extract metadata
+        stage("metadata")
+        metadata_entry, metadata_cache = await get_file_metadata(
+            input_path, file_hash, file_type, timings
+        )
+        metadata = metadata_entry["metadata"]
+        step_summary = metadata_entry["step_summary"]
+
+        # Convert to 3D and calculate dimensions in a worker process
+        stage("converting")
+        conversion, conversion_cache_status = await get_file_conversion(
+            input_path,
+            file_type,
+            file_hash,
+            options.outputFormat,
+            lod_levels(options.lods),
+            tessellation_params(options),
+            timings,
+            options.assembly,
+            options.meshEncoding,
+            options.storeArtifacts
+        )
+        dimensions = conversion["dimensions"]
+
+        response_data = {
+            "success": True,
+            **conversion,
+            "metadata": metadata,
+            "filename": filename,
+            "cache": {
+                "metadata": metadata_cache,
+                "conversion": conversion_cache_status
+            }
+        }
+
+        # AI Analysis if API key provided
+        if options.apiKey:
+            stage("analyzing")
+            file_data = {
+                "filename": filename,
+                "file_type": file_type,
+                "metadata": metadata,
+                "dimensions": dimensions,
+                "step_summary": step_summary
+            }
+
+            with stage_timer("ai", file_type, timings) as ai_stage:
+                response_data["ai_analysis"] = await analyze_file_with_ai(
+                    file_data,
+                    options.apiKey,
+                    options.aiModel,
+                    SITE_URL
+                )
+                if "error" in response_data["ai_analysis"]:
+                    ai_stage.fail()
+
+        if options.includeTimings:
+            response_data["timings"] = timings
+
+        return response_data
+
+    finally:
+        _remove(input_path)
+
+
+async def extract_file_metadata(request):
+    """Download a file and extract its metadata (see extract_local_metadata)"""
+    timings = {}
+    download = await fetch_file(request.fileUrl, request.fileType, timings)
+    return await extract_local_metadata(
+        download, request.fileType, filename_from_url(request.fileUrl), request, timings
+    )
+
+
+async def extract_local_metadata(source, file_type, filename, options, timings=None):
+    """
+    Metadata, B-rep dimensions and mass properties (and AI analysis, given an
+    API key) of a file already on disk, without 3D conversion. The file is deleted afterwards.
+    """
+    timings = {} if timings is None else timings
+    try:
+        metadata_entry, metadata_cache = await get_file_metadata(
+            source.path, source.sha256, file_type, timings
+        )
+        metadata = metadata_entry["metadata"]
+        response_data = {
+            "success": True,
+            "metadata": metadata,
+            "dimensions": None,
+            "properties": None,
+            "filename": filename,
+            "cache": {"metadata": metadata_cache}
+        }
+
+        # Metadata doesn't depend on OCC: without it, or for a file it can't
+        # import, the response still has the metadata (failures aren't cached)
+        if not is_cad_available():
+            response_data["propertiesError"] = "CAD libraries not installed"
+        else:
+            try:
+                measured, response_data["cache"]["properties"] = await get_file_properties(
+                    source.path, source.sha256, file_type, timings
+                )
+                response_data.update(measured)
+            except Exception as e:
+                response_data["propertiesError"] = f"Measuring failed: {e}"
+
+        # AI Analysis if API key provided
+        if options.apiKey:
+            file_data = {
+                "filename": filename,
+                "file_type": file_type,
+                "metadata": metadata,
+                "dimensions": response_data["dimensions"],
+                "step_summary": metadata_entry["step_summary"]
+            }
+
+            with stage_timer("ai", file_type, timings) as ai_stage:
+                response_data["ai_analysis"] = await analyze_file_with_ai(
+                    file_data,
+                    options.apiKey,
+                    options.aiModel,
+                    SITE_URL
+                )
+                if "error" in response_data["ai_analysis"]:
+                    ai_stage.fail()
+
+        if options.includeTimings:
+            response_data["timings"] = timings
+
+        return response_data
+
+    finally:
+        _remove(source.path)
+
+
+class StageLimits:
+    """Concurrency limits for the download, conversion and AI stages of a batch"""
+
+    def __init__(
+        self,
+        downloads=BATCH_DOWNLOAD_CONCURRENCY,
+        conversions=BATCH_CONVERT_CONCURRENCY,
+        ai_calls=BATCH_AI_CONCURRENCY
+    ):
+        self.download = asyncio.Semaphore(downloads)
+        self.convert = asyncio.Semaphore(conversions)
+        self.ai = asyncio.Semaphore(ai_calls)
+
+
+class BatchDeduplicator:
+    """
+    Shares work between files of one batch.
+    Byte-identical files are processed once; files whose shapes have the same
+    fingerprint (taken before tessellation) share one conversion and AI analysis.
+    """
+
+    def __init__(self):
+        self._leaders = {}
+
+    def join(self, key, index):
+        """
+        Register a file under a key. Returns the index of the file doing the work
+        for that key and a future for its outcome; the first file to join leads.
+        """
+        if key not in self._leaders:
+            self._leaders[key] = (index, asyncio.get_running_loop().create_future())
+        return self._leaders[key]
+
+    @staticmethod
+    def resolve(shared, value):
+        if not shared.done():
+            shared.set_result(value)
+
+    @staticmethod
+    def abandon(shared):
+        """Release files waiting on a leader that stopped before finishing"""
+        if not shared.done():
+            shared.cancel()
+
+
+# Fields only sent once per group of identical files
+_MESH_FIELDS = ("gltf", "glb", "artifact", "lods")
+
+# Conversion results copied to the other files of the same shape
+_SHAPE_FIELDS = ("dimensions", "triangles", "instancedTriangles", "fingerprint", "assembly")
+
+
+def batch_part_key(fingerprint, metadata, file_hash):
+    """
+    Key grouping the files of a batch into one part: the same shape, part
+    number, product name and material. Files without a fingerprint only group
+    with byte-identical copies.
+    """
+    if not fingerprint:
+        return file_hash
+    metadata = metadata or {}
+    products = metadata.get("products") or [{}]
+    return (fingerprint, metadata.get("part_number"), products[0].get("name"), metadata.get("material"))
+
+
+async def process_batch_file(file_req, request, limits, index=0, dedup=None, upload=None):
+    """
+    Download, convert and analyze one file of a batch. An uploaded file
+    (a DownloadedFile already on disk) is used instead of downloading.
+    Returns the file's result, the data collected for BOM generation (or None),
+    and its part key (see batch_part_key; the content hash without a preview) for grouping.
+    Errors are reported in the result instead of raised, so one bad file can't fail the batch.
+    """
+    filename = file_req.fileName or filename_from_url(file_req.fileUrl)
+    input_path = upload.path if upload else None
+    file_shared = None
+    shape_shared = None
+    shape_share = None
+    outcome = None
+
+    try:
+        # Download file
+        timings = {}
+        if upload:
+            download = upload
+        else:
+            async with limits.download:
+                download = await fetch_file(file_req.fileUrl, file_req.fileType, timings)
+        input_path = download.path
+        file_hash = download.sha256
+
+        # A byte-identical file earlier in the batch does the work for this one
+        if dedup is not None:
+            leader, file_shared = dedup.join(("file", file_hash), index)
+            if leader != index:
+                leader_result, leader_data, part_key = await asyncio.shield(file_shared)
+                file_shared = None
+                file_result = dict(leader_result)
+                file_result["filename"] = filename
+                if leader_result.get("success"):
+                    file_result["duplicate_of"] = leader
+                file_data = dict(leader_data, filename=filename) if leader_data else None
+                outcome = (file_result, file_data, part_key)
+                return outcome
+
+        file_result = {
+            "filename": filename,
+            "file_type": file_req.fileType,
+            "success": True,
+            "cache": {}
+        }
+
+        # Extract metadata, and fingerprint the shape so its copies wait for one conversion
+        step_summary = None
+        part_key = file_hash
+        fingerprint_first = dedup is not None and request.generatePreview and len(request.files) > 1
+        async with limits.convert:
+            if request.extractMetadata:
+                metadata_entry, file_result["cache"]["metadata"] = await get_file_metadata(
+                    input_path, file_hash, file_req.fileType, timings
+                )
+                step_summary = metadata_entry["step_summary"]
+                file_result["metadata"] = metadata_entry["metadata"]
+
+            if fingerprint_first:
+                # The imported shape is kept, so the conversion doesn't import the file again
+                measured, file_result["cache"]["properties"] = await get_file_properties(
+                    input_path, file_hash, file_req.fileType, timings, keep_shape=True
+                )
+                part_key = batch_part_key(measured["fingerprint"], file_result.get("metadata"), file_hash)
+
+        # The first file of each shape converts and analyzes it for the others
+        shared = None
+        if dedup is not None:
+            shape_leader, shape_shared = dedup.join(("shape", part_key), index)
+            if shape_leader != index:
+                shared = await asyncio.shield(shape_shared)  # None if the leader failed
+                shape_shared = None
+
+        if shared is not None:
+            conversion, ai_analysis = shared
+            file_result.update(conversion)
+        else:
+            ai_analysis = None
+            if request.generatePreview:
+                async with limits.convert:
+                    conversion, file_result["cache"]["conversion"] = await get_file_conversion(
+                        input_path,
+                        file_req.fileType,
+                        file_hash,
+                        request.outputFormat,
+                        lod_levels(request.lods),
+                        tessellation_params(request),
+                        timings,
+                        request.assembly,
+                        request.meshEncoding,
+                        request.storeArtifacts
+                    )
+                file_result.update(conversion)
+                if not fingerprint_first:
+                    part_key = batch_part_key(file_result.get("fingerprint"), file_result.get("metadata"), file_hash)
+
+        # Individual AI analysis, once per distinct shape
+        file_data = None
+        if request.apiKey:
+            file_data = {
+                "filename": file_result["filename"],
+                "file_type": file_result["file_type"],
+                "metadata": file_result.get("metadata", {}),
+                "dimensions": file_result.get("dimensions", {}),
+                "step_summary": step_summary
+            }
+
+            if shared is None:
+                async with limits.ai:
+                    with stage_timer("ai", file_req.fileType, timings) as ai_stage:
+                        ai_analysis = await analyze_file_with_ai(
+                            file_data,
+                            request.apiKey,
+                            request.aiModel,
+                            SITE_URL
+                        )
+                        if "error" in ai_analysis:
+                            ai_stage.fail()
+            file_result["ai_analysis"] = copy.deepcopy(ai_analysis)
+
+        if shape_shared is not None:
+            shape_share = (
+                {key: value for key, value in file_result.items() if key in _SHAPE_FIELDS},
+                ai_analysis
+            )
+
+        if request.includeTimings:
+            file_result["timings"] = timings
+
+        outcome = (file_result, file_data, part_key)
+        return outcome
+
+    except Exception as e:
+        outcome = ({
+            "filename": filename,
+            "success": False,
+            "error": str(e)
+        }, None, None)
+        return outcome
+
+    finally:
+        if shape_shared is not None:
+            if outcome is not None:
+                # Copies of a shape whose conversion failed convert themselves
+                dedup.resolve(shape_shared, shape_share)
+            else:
+                dedup.abandon(shape_shared)
+        if file_shared is not None:
+            if outcome is not None:
+                # Duplicates don't get the mesh, so it isn't kept for them
+                result, data, key = outcome
+                dedup.resolve(file_shared, (
+                    {name: value for name, value in result.items() if name not in _MESH_FIELDS},
+                    data,
+                    key
+                ))
+            else:
+                dedup.abandon(file_shared)
+        if input_path:
+            _remove(input_path)
+            _remove(saved_shape_path(input_path))
+
+
+def group_parts(outcomes):
+    """
+    Group successful files by part key. Returns {primary index: quantity}, where
+    the primary is the first file of each group, and marks the other files of a
+    group with duplicate_of.
+    """
+    groups = {}
+    for index, (file_result, _, part_key) in outcomes:
+        if part_key is not None and file_result.get("success"):
+            groups.setdefault(part_key, []).append(index)
+
+    quantities = {}
+    duplicates = {}
+    for indices in groups.values():
+        quantities[indices[0]] = len(indices)
+        for index in indices[1:]:
+            duplicates[index] = indices[0]
+    return quantities, duplicates
+
+
+def _bom_files_data(outcomes, quantities, duplicates):
+    """
+    BOM input with one entry per distinct part, carrying its quantity and the
+    names of the other files of its group
+    """
+    copies = {}
+    for index, (_, file_data, _) in outcomes:
+        if file_data is not None and index in duplicates:
+            copies.setdefault(duplicates[index], []).append(file_data["filename"])
+
+    files_data = []
+    for index, (_, file_data, _) in outcomes:
+        if file_data is not None and index in quantities:
+            entry = dict(file_data, quantity=quantities[index])
+            if index in copies:
+                entry["same_part_files"] = copies[index]
+            files_data.append(entry)
+    return files_data
+
+
+async def process_batch(request, limits=None, on_result=None, uploads=None):
+    """
+    Run every file of a batch through the pipeline concurrently.
+    Stages overlap across files within their limits; results keep the request order.
+    on_result(index, file_result) is called as each file finishes.
+    uploads, if given, holds the already-saved file for each entry of request.files.
+    """
+    limits = limits or StageLimits()
+    dedup = BatchDeduplicator() if request.deduplicate else None
+
+    async def process(index, file_req):
+        upload = uploads[index] if uploads else None
+        outcome = await process_batch_file(file_req, request, limits, index, dedup, upload)
+        if on_result:
+            on_result(index, outcome[0])
+        return outcome
+
+    outcomes = list(enumerate(await asyncio.gather(*[
+        process(index, file_req)
+        for index, file_req in enumerate(request.files)
+    ])))
+
+    results = [file_result for _, (file_result, _, _) in outcomes]
+    if not request.deduplicate:
+        return results, [file_data for _, (_, file_data, _) in outcomes if file_data is not None]
+
+    quantities, duplicates = group_parts(outcomes)
+    for index, quantity in quantities.items():
+        results[index]["quantity"] = quantity
+    for index, primary in duplicates.items():
+        results[index]["duplicate_of"] = primary
+
+    return results, _bom_files_data(outcomes, quantities, duplicates)
+
+
+async def run_batch(request, on_result=None, uploads=None):
+    """Process a batch and build its response, generating a BOM if requested"""
+    results, files_data = await process_batch(request, on_result=on_result, uploads=uploads)
+
+    response_data = {
+        "success": True,
+        "total_files": len(request.files),
+        "processed": len([r for r in results if r.get("success")]),
+        "failed": len([r for r in results if not r.get("success")]),
+        "files": results
+    }
+    if request.deduplicate:
+        response_data["unique_parts"] = len([r for r in results if "quantity" in r])
+
+    # Generate BOM if requested
+    if request.generateBOM and request.apiKey and files_data:
+        with stage_timer("bom") as bom_stage:
+            response_data["bom"] = await generate_bom_from_batch(
+                files_data,
+                request.apiKey,
+                request.aiModel,
+                SITE_URL
+            )
+            if "error" in response_data["bom"]:
+                bom_stage.fail()
+
+    return response_data
+
+
+async def stream_batch(request, limits=None, uploads=None, max_in_flight=BATCH_STREAM_IN_FLIGHT):
+    """
+    Process a batch and yield one record per file as soon as it finishes,
+    then a summary and (if requested) the BOM. At most max_in_flight files
+    are processed at once, and a file's result is dropped once it has been
+    yielded, so memory is bounded by max_in_flight, not the batch size.
+    """
+    limits = limits or StageLimits()
+    dedup = BatchDeduplicator() if request.deduplicate else None
+
+    async def process(index, file_req):
+        upload = uploads[index] if uploads else None
+        return index, await process_batch_file(file_req, request, limits, index, dedup, upload)
+
+    # Files start in request order, so a duplicate's leader is always already running
+    queued = enumerate(request.files)
+    pending = {
+        asyncio.ensure_future(process(index, file_req))
+        for index, file_req in itertools.islice(queued, max(max_in_flight, 1))
+    }
+    processed = 0
+    failed = 0
+    # Only the small per-file BOM inputs and shape keys are kept
+    light_outcomes = []
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for index, file_req in itertools.islice(queued, 1):
+                    pending.add(asyncio.ensure_future(process(index, file_req)))
+
+                index, (file_result, file_data, part_key) = task.result()
+                if file_result.get("success"):
+                    processed += 1
+                else:
+                    failed += 1
+                light_outcomes.append((index, ({"success": file_result.get("success")}, file_data, part_key)))
+                yield {"type": "file", "index": index, **file_result}
+    finally:
+        # The client went away mid-stream: stop the remaining files
+        for task in pending:
+            task.cancel()
+
+    light_outcomes.sort(key=lambda outcome: outcome[0])
+    summary = {
+        "type": "summary",
+        "success": True,
+        "total_files": len(request.files),
+        "processed": processed,
+        "failed": failed
+    }
+    if request.deduplicate:
+        quantities, duplicates = group_parts(light_outcomes)
+        summary["unique_parts"] = len(quantities)
+        summary["parts"] = [
+            {"index": index, "quantity": quantity}
+            for index, quantity in sorted(quantities.items())
+        ]
+        files_data = _bom_files_data(light_outcomes, quantities, duplicates)
+    else:
+        files_data = [file_data for _, (_, file_data, _) in light_outcomes if file_data is not None]
+    yield summary
+
+    if request.generateBOM and request.apiKey and files_data:
+        with stage_timer("bom") as bom_stage:
+            bom = await generate_bom_from_batch(
+                files_data,
+                request.apiKey,
+                request.aiModel,
+                SITE_URL
+            )
+            if "error" in bom:
+                bom_stage.fail()
+        yield {"type": "bom", "bom": bom}
@@ -0,0 +1,166 @@
+"""
+Compact descriptions of CAD files for AI prompts, sized to a token budget
+Authors: Josh Ayokhai & River
+"""
+
+# Rough characters per token for English and identifiers; close enough to
+# budget prompts without a tokenizer for every supported model
+CHARS_PER_TOKEN = 4
+
+# Longest name or property value written into a prompt
+_MAX_VALUE_CHARS = 80
+
+# Entity types listed in the entity count summary
+_MAX_ENTITY_TYPES = 12
+
+# Custom properties whose names suggest a material are listed first
+_MATERIAL_WORDS = ("material", "finish", "coating", "grade", "alloy", "density", "treatment")
+
+
+def estimate_tokens(text):
+    """Estimated number of tokens in a piece of text"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def prompt_size(prompt, budget):
+    """Size report for a prompt sent to the AI"""
+    return {
+        "characters": len(prompt),
+        "estimated_tokens": estimate_tokens(prompt),
+        "token_budget": budget
+    }
+
+
+def _text(value):
+    text = " ".join(str(value).split())
+    if len(text) > _MAX_VALUE_CHARS:
+        text = text[:_MAX_VALUE_CHARS - 3] + "..."
+    return text
+
+
+def _number(value):
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def _header_lines(metadata, summary):
+    lines = []
+    for label, value in (
+        ("Part name", metadata.get("part_name")),
+        ("Part number", metadata.get("part_number")),
+        ("Description", metadata.get("description")),
+        ("Author", metadata.get("author")),
+        ("Organization", metadata.get("organization")),
+        ("CAD system", summary.get("originating_system")),
+        ("STEP schema", summary.get("schema"))
+    ):
+        if value:
+            lines.append(f"{label}: {_text(value)}")
+
+    units = summary.get("units")
+    if units:
+        lines.append("Units: " + ", ".join(f"{kind} {name}" for kind, name in units.items()))
+    return lines
+
+
+def _dimension_lines(dimensions):
+    if not dimensions or dimensions.get("length") is None:
+        return []
+    units = dimensions.get("units", "")
+    line = "Dimensions ({}): {} x {} x {}".format(
+        units, *(_number(dimensions.get(axis)) for axis in ("length", "width", "height"))
+    )
+    if dimensions.get("volume") is not None:
+        line += f", volume {_number(dimensions['volume'])}"
+    return [line]
+
+
+def _material_lines(metadata):
+    lines = []
+    if metadata.get("material"):
+        lines.append(f"Material: {_text(metadata['material'])}")
+
+    properties = sorted(
+        (metadata.get("custom_properties") or {}).items(),
+        key=lambda item: not any(word in item[0].lower() for word in _MATERIAL_WORDS)
+    )
+    for name, value in properties:
+        if value == metadata.get("material"):
+            continue
+        lines.append(f"Property {_text(name)}: {_text(value)}")
+    return lines
+
+
+def _entity_lines(summary):
+    counts = summary.get("entity_counts")
+    if not counts:
+        return []
+    top = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:_MAX_ENTITY_TYPES]
+    return [
+        f"Entities: {sum(counts.values())} in {len(counts)} types; "
+        + ", ".join(f"{name} {count}" for name, count in top)
+    ]
+
+
+def _node_label(node):
+    name = node.get("name") or node.get("part_number") or "unnamed"
+    label = _text(name)
+    if node.get("part_number") and node["part_number"] != name:
+        label += f" [{_text(node['part_number'])}]"
+    return label
+
+
+def _assembly_lines(metadata):
+    """The assembly tree, depth first, one indented line per node"""
+    lines = []
+    stack = [(node, 0) for node in reversed(metadata.get("assembly") or [])]
+    while stack:
+        node, depth = stack.pop()
+        lines.append(f"{'  ' * depth}- {node.get('quantity', 1)}x {_node_label(node)}")
+        stack.extend((child, depth + 1) for child in reversed(node.get("children", [])))
+    if lines:
+        lines.insert(0, "Assembly tree:")
+        return lines
+
+    # No assembly structure: list the distinct products instead
+    names = []
+    for product in metadata.get("products") or []:
+        label = _node_label(product)
+        if label not in names:
+            names.append(label)
+    if len(names) > 1:
+        return ["Products:"] + [f"- {name}" for name in names]
+    return []
+
+
+def file_context(file_data, max_tokens):
+    """
+    Describe a file for a prompt in at most about max_tokens tokens: header
+    fields and units, dimensions, material hints, entity counts, then the
+    assembly tree. Sections are added in that order, line by line, and a
+    section that doesn't fit is cut off with a note of how much was left out.
+    """
+    metadata = file_data.get("metadata") or {}
+    summary = file_data.get("step_summary") or {}
+    sections = [
+        _header_lines(metadata, summary),
+        _dimension_lines(file_data.get("dimensions")),
+        _material_lines(metadata),
+        _entity_lines(summary),
+        _assembly_lines(metadata)
+    ]
+
+    budget = max_tokens * CHARS_PER_TOKEN
+    used = 0
+    lines = []
+    for section in sections:
+        for index, line in enumerate(section):
+            if used + len(line) + 1 <= budget:
+                lines.append(line)
+                used += len(line) + 1
+                continue
+            omitted = f"... {len(section) - index} more lines omitted"
+            if used + len(omitted) + 1 <= budget:
+                lines.append(omitted)
+                used += len(omitted) + 1
+            break
+    return "\n".join(lines)
@@ -0,0 +1,102 @@
+"""
+Tests for AI request rate limiting and retries
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app import ai_dispatcher as dispatcher_module
+from app.ai_dispatcher import AIDispatcher, TokenBucket
+
+
+class FakeClock:
+    """Stands in for time.monotonic and asyncio.sleep; sleeping moves the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dispatcher_module, "time", SimpleNamespace(monotonic=clock.monotonic, time=time.time))
+    monkeypatch.setattr(dispatcher_module, "asyncio", SimpleNamespace(
+        Lock=asyncio.Lock, Semaphore=asyncio.Semaphore, sleep=clock.sleep
+    ))
+    return clock
+
+
+def test_token_bucket_allows_burst_then_waits(clock):
+    async def run():
+        bucket = TokenBucket(rate=2.0, capacity=3)
+        for _ in range(5):
+            await bucket.acquire()
+
+    asyncio.run(run())
+    assert clock.sleeps == [0.5, 0.5]
+    assert clock.now == 1.0
+
+
+def test_token_bucket_refills_while_idle(clock):
+    async def run():
+        bucket = TokenBucket(rate=1.0, capacity=2)
+        await bucket.acquire()
+        await bucket.acquire()
+        clock.now += 10
+        await bucket.acquire()
+        await bucket.acquire()
+
+    asyncio.run(run())
+    assert clock.sleeps == []
+
+
+def dispatch(monkeypatch, responses, **options):
+    """POST through a dispatcher whose client answers with responses in turn"""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return responses[min(len(calls), len(responses)) - 1]
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(dispatcher_module, "get_ai_client", lambda: client)
+        try:
+            return await AIDispatcher(rate_per_minute=0, **options).post("https://ai.test/chat", "key")
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), calls
+
+
+def test_retries_after_rate_limit(clock, monkeypatch):
+    responses = [httpx.Response(429, headers={"Retry-After": "2"}), httpx.Response(200, json={})]
+    response, calls = dispatch(monkeypatch, responses)
+    assert response.status_code == 200
+    assert len(calls) == 2
+    assert clock.sleeps == [2.0]
+
+
+def test_client_errors_are_not_retried(clock, monkeypatch):
+    with pytest.raises(httpx.HTTPStatusError):
+        dispatch(monkeypatch, [httpx.Response(400)])
+    assert clock.sleeps == []
+
+
+def test_gives_up_after_max_retries(clock, monkeypatch):
+    with pytest.raises(httpx.HTTPStatusError):
+        dispatch(monkeypatch, [httpx.Response(503)], max_retries=2, base_delay=1.0)
+    assert len(clock.sleeps) == 2
+    assert all(0 <= delay <= 2.0 for delay in clock.sleeps)
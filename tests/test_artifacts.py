@@ -0,0 +1,104 @@
+"""
+Tests for the artifact store and its HTTP handling
+Authors: Josh Ayokhai & River
+"""
+import pytest
+from starlette.requests import Request
+
+from app.artifacts import ArtifactStore, _byte_range, artifact_response
+
+DATA = b"glTF" + bytes(range(256)) * 16
+
+
+def make_request(headers=None, method="GET"):
+    return Request({
+        "type": "http",
+        "method": method,
+        "headers": [(name.encode(), value.encode()) for name, value in (headers or {}).items()]
+    })
+
+
+@pytest.fixture
+def stored(tmp_path):
+    store = ArtifactStore(str(tmp_path), ttl=3600)
+    return store, store.put(DATA, "glb")
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=95-200", (95, 99)),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=-", None)
+])
+def test_byte_range(header, expected):
+    assert _byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=5-2", "bytes=-0"])
+def test_unsatisfiable_byte_range(header):
+    with pytest.raises(ValueError):
+        _byte_range(header, 100)
+
+
+def test_put_returns_content_addressed_reference(stored):
+    store, reference = stored
+    assert reference["size"] == len(DATA)
+    assert reference["etag"] == f'"{reference["name"].split(".")[0]}"'
+    assert store.put(DATA, "glb") == reference
+
+
+def test_range_request(stored):
+    store, reference = stored
+    response = artifact_response(make_request({"range": "bytes=4-7"}), reference["name"], store)
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 4-7/{len(DATA)}"
+    assert response.headers["content-length"] == "4"
+
+
+def test_unsatisfiable_range_request(stored):
+    store, reference = stored
+    response = artifact_response(make_request({"range": f"bytes={len(DATA)}-"}), reference["name"], store)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+def test_stale_if_range_returns_whole_file(stored):
+    store, reference = stored
+    headers = {"range": "bytes=4-7", "if-range": '"0123"'}
+    response = artifact_response(make_request(headers), reference["name"], store)
+    assert response.status_code == 200
+    assert "content-range" not in response.headers
+
+
+def test_if_none_match(stored):
+    store, reference = stored
+    response = artifact_response(make_request({"if-none-match": reference["etag"]}), reference["name"], store)
+    assert response.status_code == 304
+
+    response = artifact_response(make_request({"if-none-match": '"0123"'}), reference["name"], store)
+    assert response.status_code == 200
+
+
+def test_reference_etag_matches_compressed_response(stored):
+    store, reference = stored
+    headers = {"if-none-match": reference["etag"], "accept-encoding": "gzip"}
+    response = artifact_response(make_request(headers), reference["name"], store)
+    assert response.status_code == 304
+    assert response.headers["etag"] != reference["etag"]
+
+
+def test_compressed_response(stored):
+    store, reference = stored
+    response = artifact_response(make_request({"accept-encoding": "gzip"}), reference["name"], store)
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == reference["etag"][:-1] + '-gzip"'
+
+
+def test_unknown_artifact(stored):
+    store, _ = stored
+    assert artifact_response(make_request(), "0" * 64 + ".glb", store) is None
+    assert artifact_response(make_request(), "../secrets.glb", store) is None
@@ -0,0 +1,52 @@
+"""
+Tests for the conversion result cache
+Authors: Josh Ayokhai & River
+"""
+import os
+
+from app.cache import ConversionCache, cache_key
+
+
+def age(cache, key, seconds):
+    """Move an entry's last use back in time"""
+    path = os.path.join(cache.directory, f"{key}.json")
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime - seconds, stat.st_mtime - seconds))
+
+
+def test_cache_key_depends_on_file_and_params():
+    assert cache_key("abc", quality="fine") == cache_key("abc", quality="fine")
+    assert cache_key("abc", quality="fine") != cache_key("abc", quality="draft")
+    assert cache_key("abc", quality="fine") != cache_key("abd", quality="fine")
+
+
+def test_get_and_put(tmp_path):
+    cache = ConversionCache(str(tmp_path), max_size=1024 * 1024)
+    assert cache.get("a") is None
+    cache.put("a", {"triangles": 12})
+    assert cache.get("a") == {"triangles": 12}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry = {"data": "x" * 100}
+    cache = ConversionCache(str(tmp_path), max_size=350)
+    cache.put("a", entry)
+    cache.put("b", entry)
+    age(cache, "a", 20)
+    age(cache, "b", 10)
+
+    cache.get("a")  # a is now the most recently used
+    cache.put("c", entry)
+    cache.put("d", entry)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == entry
+    assert cache.get("c") == entry
+    assert cache.get("d") == entry
+
+
+def test_disabled_cache(tmp_path):
+    cache = ConversionCache(str(tmp_path / "cache"), max_size=1024, enabled=False)
+    cache.put("a", {"triangles": 12})
+    assert cache.get("a") is None
+    assert not os.path.exists(tmp_path / "cache")
@@ -0,0 +1,144 @@
+"""
+Tests for the persistent job queue
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import json
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import jobs
+from app.jobs import JobRunner, JobStore
+
+BATCH_REQUEST = {"files": [
+    {"fileUrl": "https://example.com/a.step", "fileType": "step"},
+    {"fileUrl": "https://example.com/b.step", "fileType": "step"}
+]}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.time for lease expiry"""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(jobs, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(str(tmp_path / "jobs.db"), max_attempts=2)
+
+
+def test_claim_takes_oldest_queued_job(store, clock):
+    first = store.submit("convert", {"n": 1})
+    clock.now += 1
+    second = store.submit("convert", {"n": 2})
+
+    assert store.claim()["id"] == first
+    assert store.claim()["id"] == second
+    assert store.claim() is None
+    assert store.get(first)["status"] == "running"
+    assert store.get(first)["attempts"] == 1
+
+
+def test_expired_lease_is_claimed_again(store, clock):
+    job_id = store.submit("convert", {})
+    store.claim()
+
+    clock.now += jobs.JOB_LEASE_SECONDS - 1
+    store.renew_lease(job_id)
+    clock.now += jobs.JOB_LEASE_SECONDS - 1
+    assert store.claim() is None  # still leased after the renewal
+
+    clock.now += 2
+    job = store.claim()
+    assert job["id"] == job_id
+    assert store.get(job_id)["attempts"] == 2
+
+
+def test_job_fails_after_max_attempts(store, clock):
+    job_id = store.submit("convert", {})
+    for _ in range(2):
+        assert store.claim()["id"] == job_id
+        clock.now += jobs.JOB_LEASE_SECONDS + 1
+
+    assert store.claim() is None
+    job = store.get(job_id)
+    assert job["status"] == "failed"
+    assert "2 times" in job["error"]
+    assert job["expires_at"] == clock.now + jobs.JOB_RESULT_TTL
+
+
+def test_requeue_does_not_use_an_attempt(store, clock):
+    job_id = store.submit("convert", {})
+    for _ in range(3):
+        assert store.claim()["id"] == job_id
+        store.requeue(job_id)
+    assert store.get(job_id)["attempts"] == 0
+
+
+def test_finished_job_ignores_progress_and_expires(store, clock):
+    job_id = store.submit("convert", {})
+    store.claim()
+    store.finish(job_id, {"success": True})
+    store.update_progress(job_id, {"stage": "convert"})
+
+    job = store.get(job_id)
+    assert job["status"] == "completed"
+    assert job["progress"] is None
+    assert json.loads(job["result"]) == {"success": True}
+
+    clock.now += jobs.JOB_RESULT_TTL + 1
+    store.purge_expired()
+    assert store.get(job_id) is None
+
+
+def test_adds_attempts_column_to_old_database(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+        "request TEXT NOT NULL, progress TEXT, result TEXT, error TEXT, created_at REAL NOT NULL, "
+        "updated_at REAL NOT NULL, lease_expires_at REAL, expires_at REAL)"
+    )
+    db.execute("INSERT INTO jobs VALUES ('old', 'convert', 'queued', '{}', NULL, NULL, NULL, 1, 1, NULL, NULL)")
+    db.commit()
+    db.close()
+
+    job = JobStore(path).claim()
+    assert job["id"] == "old"
+    assert job["attempts"] == 0
+
+
+def test_batch_job_saves_final_progress(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    update_progress = store.update_progress
+
+    def slow_update_progress(job_id, progress):
+        time.sleep(0.05)
+        update_progress(job_id, progress)
+
+    async def run_batch(request, on_result=None):
+        for index in range(len(request.files)):
+            on_result(index, {"success": True})
+        return {"success": True}
+
+    monkeypatch.setattr(store, "update_progress", slow_update_progress)
+    monkeypatch.setattr(jobs, "run_batch", run_batch)
+
+    async def run():
+        runner = JobRunner(store)
+        store.submit("batch-convert", BATCH_REQUEST)
+        job = store.claim()
+        result = await runner._execute(job)
+        store.finish(job["id"], result)
+        return store.get(job["id"])
+
+    job = asyncio.run(run())
+    progress = json.loads(job["progress"])
+    assert job["status"] == "completed"
+    assert progress["completed"] == 2
+    assert [f["status"] for f in progress["files"]] == ["done", "done"]
@@ -0,0 +1,81 @@
+"""
+Tests for compact mesh encoding
+Authors: Josh Ayokhai & River
+"""
+import json
+import struct
+
+import numpy as np
+import trimesh
+
+from app.mesh_encoding import encode_mesh, weld
+
+_COMPONENT_TYPES = {5122: np.int16, 5123: np.uint16, 5125: np.uint32, 5126: np.float32}
+
+
+def unwelded_box():
+    """A box whose triangles share no vertices, as a tessellator may produce"""
+    box = trimesh.creation.box([4.0, 2.0, 1.0])
+    vertices = box.vertices[box.faces].reshape(-1, 3)
+    return trimesh.Trimesh(vertices=vertices, faces=np.arange(len(vertices)).reshape(-1, 3), process=False)
+
+
+def decode_glb(glb):
+    """Triangles of a single-mesh GLB as an (n, 3, 3) array in model space"""
+    json_length, = struct.unpack_from("<I", glb, 12)
+    document = json.loads(glb[20:20 + json_length])
+    binary = glb[20 + json_length + 8:]
+
+    def accessor(index, components):
+        spec = document["accessors"][index]
+        view = document["bufferViews"][spec["bufferView"]]
+        dtype = np.dtype(_COMPONENT_TYPES[spec["componentType"]])
+        stride = view.get("byteStride", dtype.itemsize * components) // dtype.itemsize
+        data = np.frombuffer(binary, dtype, view["byteLength"] // dtype.itemsize, view["byteOffset"])
+        return data.reshape(-1, stride)[:spec["count"], :components]
+
+    primitive = document["meshes"][0]["primitives"][0]
+    indices = accessor(primitive["indices"], 1).reshape(-1, 3)
+    positions = accessor(primitive["attributes"]["POSITION"], 3).astype(np.float64)
+    node = document["nodes"][0]
+    positions = positions * node.get("scale", [1.0] * 3) + node.get("translation", [0.0] * 3)
+    return document, positions[indices]
+
+
+def sorted_triangles(triangles):
+    return np.array(sorted(tuple(np.round(t, 6).reshape(-1)) for t in triangles))
+
+
+def test_weld_merges_vertices_and_drops_degenerate_triangles():
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 0, 0], [0, 0, 0]], dtype=np.float32)
+    faces = np.array([[0, 1, 2], [3, 2, 4], [0, 4, 1]])
+    welded, welded_faces = weld(vertices, faces)
+    assert len(welded) == 3
+    assert len(welded_faces) == 2
+
+
+def test_encoded_glb_round_trips():
+    box = unwelded_box()
+    glb, report = encode_mesh(box, "glb")
+    document, triangles = decode_glb(glb)
+
+    assert report["vertices"] == {"before": 36, "after": 8}
+    assert report["bufferBytes"]["after"] < report["bufferBytes"]["before"]
+    assert document["accessors"][0]["componentType"] == 5123  # 16-bit indices
+    np.testing.assert_array_equal(sorted_triangles(triangles), sorted_triangles(box.triangles))
+
+
+def test_quantized_glb_round_trips_within_grid_step():
+    box = unwelded_box()
+    glb, report = encode_mesh(box, "glb", quantize=True)
+    document, triangles = decode_glb(glb)
+
+    assert report["quantized"]
+    assert "KHR_mesh_quantization" in document["extensionsRequired"]
+    step = 4.0 / 2 / 32767
+    assert np.abs(sorted_triangles(triangles) - sorted_triangles(box.triangles)).max() <= step
+
+
+def test_gltf_embeds_buffer():
+    document, _ = encode_mesh(unwelded_box(), "gltf")
+    assert document["buffers"][0]["uri"].startswith("data:application/octet-stream;base64,")
@@ -0,0 +1,64 @@
+"""
+Tests for STEP metadata extraction
+Authors: Josh Ayokhai & River
+"""
+import pytest
+
+from app import metadata as step_metadata
+from app.metadata import extract_step_context, extract_step_metadata, scan_step_file
+
+STEP_FILE = """ISO-10303-21;
+HEADER;
+FILE_DESCRIPTION(('Bracket'),'2;1');
+FILE_NAME('bracket.step','2024-01-01T10:00:00',('Ann'),('ACME'),'pp','CAD 1.0','');
+FILE_SCHEMA(('AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }'));
+ENDSEC;
+DATA;
+#1=PRODUCT('BRK-1','Bracket','',(#9));
+#10=( LENGTH_UNIT() NAMED_UNIT(*) SI_UNIT(.MILLI.,.METRE.) );
+ENDSEC;
+END-ISO-10303-21;
+"""
+
+
+def write_step(tmp_path, data):
+    path = tmp_path / "part.step"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_plain_file(tmp_path):
+    metadata = extract_step_metadata(write_step(tmp_path, STEP_FILE.encode("ascii")))
+    assert metadata["part_number"] == "BRK-1"
+    assert metadata["author"] == "Ann"
+
+
+def test_byte_order_mark_and_leading_comment(tmp_path):
+    data = b"\xef\xbb\xbf/* exported by CAD 1.0 */\r\n" + STEP_FILE.encode("ascii")
+    context = extract_step_context(write_step(tmp_path, data))
+    assert context["metadata"]["part_number"] == "BRK-1"
+    assert context["metadata"]["description"] == "Bracket"
+    assert context["summary"]["units"] == {"length": "millimetre"}
+
+
+def test_not_a_step_file(tmp_path):
+    metadata = extract_step_metadata(write_step(tmp_path, b"solid cube\nendsolid cube\n"))
+    assert metadata["part_number"] is None
+    assert metadata["products"] == []
+
+
+def test_statement_across_chunk_boundary(tmp_path, monkeypatch):
+    monkeypatch.setattr(step_metadata, "_CHUNK_SIZE", 16)
+    long_name = "Bracket " + "x" * 200
+    data = STEP_FILE.replace("'Bracket',''", f"'{long_name}',''").encode("ascii")
+    metadata = extract_step_metadata(write_step(tmp_path, data))
+    assert metadata["part_number"] == "BRK-1"
+    assert metadata["products"][0]["name"] == long_name
+
+
+def test_oversized_statement(tmp_path, monkeypatch):
+    monkeypatch.setattr(step_metadata, "_CHUNK_SIZE", 64)
+    monkeypatch.setattr(step_metadata, "_MAX_STATEMENT_SIZE", 1024)
+    data = STEP_FILE.replace("DATA;", "DATA;\n#2=PRODUCT('" + "x" * 4096).encode("ascii")
+    with pytest.raises(ValueError):
+        scan_step_file(write_step(tmp_path, data))
@@ -0,0 +1,71 @@
+"""
+Tests for the concurrent batch pipeline
+Authors: Josh Ayokhai & River
+"""
+import asyncio
+import hashlib
+
+import pytest
+
+from app import pipeline
+from app.download import DownloadedFile
+from app.models import BatchConversionRequest
+from app.pipeline import StageLimits, process_batch
+
+
+@pytest.fixture
+def fake_stages(monkeypatch):
+    """Download and conversion stand-ins; later files finish first"""
+    state = {"converting": 0, "most_converting": 0}
+
+    async def fetch_file(url, file_type, timings=None):
+        if "missing" in url:
+            raise ValueError("Failed to download file: HTTP 404")
+        return DownloadedFile(path=url, size=1, sha256=hashlib.sha256(url.encode()).hexdigest())
+
+    async def get_file_metadata(input_path, file_hash, file_type="step", timings=None):
+        return {"metadata": {"part_number": input_path}, "step_summary": {}}, "miss"
+
+    async def get_file_conversion(input_path, *args, **kwargs):
+        state["converting"] += 1
+        state["most_converting"] = max(state["most_converting"], state["converting"])
+        await asyncio.sleep(0.05 / int(input_path.rsplit("/", 1)[-1].split(".")[0]))
+        state["converting"] -= 1
+        return {"dimensions": {"length": 1.0}, "triangles": 12, "fingerprint": None, "gltf": {}}, "miss"
+
+    monkeypatch.setattr(pipeline, "fetch_file", fetch_file)
+    monkeypatch.setattr(pipeline, "get_file_metadata", get_file_metadata)
+    monkeypatch.setattr(pipeline, "get_file_conversion", get_file_conversion)
+    monkeypatch.setattr(pipeline, "_remove", lambda path: None)
+    return state
+
+
+def batch(*names):
+    return BatchConversionRequest(files=[
+        {"fileUrl": f"https://example.com/{name}", "fileType": "step"} for name in names
+    ])
+
+
+def test_results_keep_request_order(fake_stages):
+    finished = []
+    request = batch("1.step", "2.step", "3.step", "4.step")
+    results, files_data = asyncio.run(process_batch(
+        request, StageLimits(conversions=4), on_result=lambda index, _: finished.append(index)
+    ))
+
+    assert [r["metadata"]["part_number"] for r in results] == [f.fileUrl for f in request.files]
+    assert finished[0] != 0  # the slowest file came first but finished last
+    assert files_data == []  # no apiKey, so no AI or BOM input
+
+
+def test_failed_file_does_not_fail_batch(fake_stages):
+    results, _ = asyncio.run(process_batch(batch("1.step", "missing.step", "3.step")))
+    assert [r["success"] for r in results] == [True, False, True]
+    assert "404" in results[1]["error"]
+    assert results[1]["filename"] == "missing.step"
+
+
+def test_conversions_are_limited(fake_stages):
+    request = batch(*[f"{n}.step" for n in range(1, 9)])
+    asyncio.run(process_batch(request, StageLimits(conversions=2)))
+    assert fake_stages["most_converting"] == 2
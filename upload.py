@@ -0,0 +1,197 @@
+"""
+Streamed file uploads: raw request bodies and multipart forms
+Authors: Josh Ayokhai & River
+"""
+import json
+import os
+from collections import namedtuple
+
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+from app.download import TempFileWriter, FileTooLargeError
+from app.config import MAX_FILE_SIZE, MAX_UPLOAD_FILES, SUPPORTED_FORMATS
+
+# A file saved from a request body, with the client's file name
+UploadedFile = namedtuple("UploadedFile", ["filename", "file"])
+
+# Upload options arrive in this form field (multipart) or header (raw body) as JSON
+OPTIONS_FIELD = "options"
+OPTIONS_HEADER = "x-upload-options"
+
+# Form fields other than files are small; anything bigger is rejected
+_MAX_FIELD_SIZE = 1024 * 1024
+
+
+class UploadError(ValueError):
+    """The upload is malformed or breaks a limit other than the file size"""
+
+
+def file_type_for(filename, file_type=None):
+    """The explicit file type, or the file name's extension"""
+    if file_type:
+        return file_type.lower()
+    return os.path.splitext(filename or "")[1].lstrip(".").lower()
+
+
+def _suffix(filename):
+    file_type = file_type_for(filename)
+    return f".{file_type}" if file_type in SUPPORTED_FORMATS else ""
+
+
+def _parse_options(text):
+    if not text:
+        return {}
+    try:
+        options = json.loads(text)
+    except json.JSONDecodeError:
+        raise UploadError("Upload options must be a JSON object")
+    if not isinstance(options, dict):
+        raise UploadError("Upload options must be a JSON object")
+    return options
+
+
+def discard_uploads(files):
+    """Delete saved uploads that were not handed to the pipeline"""
+    for upload in files:
+        if os.path.exists(upload.file.path):
+            os.unlink(upload.file.path)
+
+
+class _MultipartReader:
+    """
+    Feeds a multipart body through python-multipart, writing file parts
+    straight to temp files (with the size limit enforced per chunk) and
+    keeping small form fields in memory.
+    """
+
+    def __init__(self, boundary, max_size, max_files):
+        self.max_size = max_size
+        self.max_files = max_files
+        self.fields = {}
+        self.files = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._name = None
+        self._filename = None
+        self._writer = None
+        self._field_data = bytearray()
+        self._complete = False
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_end": self._on_end,
+        })
+
+    def write(self, chunk):
+        self._parser.write(chunk)
+
+    def finish(self):
+        self._parser.finalize()
+        if not self._complete:
+            raise UploadError("Multipart body ended before its closing boundary")
+
+    def discard(self):
+        if self._writer is not None:
+            self._writer.discard()
+            self._writer = None
+        discard_uploads(self.files)
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._filename = None
+        self._field_data = bytearray()
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        disposition, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if disposition != b"form-data" or b"name" not in params:
+            raise UploadError("Multipart part without a form-data name")
+        self._name = params[b"name"].decode("utf-8", "replace")
+        if b"filename" in params:
+            if len(self.files) >= self.max_files:
+                raise UploadError(f"At most {self.max_files} files can be uploaded at once")
+            # Browsers may send a full client path as the file name
+            self._filename = os.path.basename(params[b"filename"].decode("utf-8", "replace").replace("\\", "/"))
+            self._writer = TempFileWriter(_suffix(self._filename), self.max_size)
+
+    def _on_part_data(self, data, start, end):
+        if self._writer is not None:
+            self._writer.write(data[start:end])
+        else:
+            if len(self._field_data) + end - start > _MAX_FIELD_SIZE:
+                raise UploadError(f"Form field '{self._name}' is too large")
+            self._field_data += data[start:end]
+
+    def _on_part_end(self):
+        if self._writer is not None:
+            self.files.append(UploadedFile(self._filename, self._writer.finish()))
+            self._writer = None
+        else:
+            self.fields[self._name] = self._field_data.decode("utf-8", "replace")
+        self._name = None
+
+    def _on_end(self):
+        self._complete = True
+
+
+async def receive_upload(request, max_size=MAX_FILE_SIZE, max_files=MAX_UPLOAD_FILES):
+    """
+    Stream the files in a request body to disk.
+    multipart/form-data bodies may carry several file parts and an 'options'
+    field; any other body is one raw file, named by the 'filename' query
+    parameter, with options in the X-Upload-Options header.
+    Returns (options dict, [UploadedFile]); the caller owns the saved files.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+
+    if content_type != b"multipart/form-data":
+        content_length = request.headers.get("content-length")
+        if content_length and int(content_length) > max_size:
+            raise FileTooLargeError(int(content_length), max_size)
+
+        options = _parse_options(request.headers.get(OPTIONS_HEADER))
+        filename = os.path.basename(request.query_params.get("filename") or options.get("fileName") or "")
+        writer = TempFileWriter(_suffix(filename), max_size)
+        try:
+            async for chunk in request.stream():
+                writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        return options, [UploadedFile(filename, writer.finish())]
+
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise UploadError("Multipart body without a boundary")
+
+    reader = _MultipartReader(boundary, max_size, max_files)
+    try:
+        async for chunk in request.stream():
+            reader.write(chunk)
+        reader.finish()
+        options = _parse_options(reader.fields.get(OPTIONS_FIELD))
+    except MultipartParseError as e:
+        reader.discard()
+        raise UploadError(f"Malformed multipart body: {e}")
+    except BaseException:
+        reader.discard()
+        raise
+    return options, reader.files
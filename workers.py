@@ -0,0 +1,418 @@
+"""
+Process pool for CPU-bound CAD conversion work
+Authors: Josh Ayokhai & River
+
+Each worker process runs one job at a time and reports its resident memory
+after every job. A worker retires after WORKER_MAX_JOBS jobs or once it is
+above WORKER_MAX_RSS_MB, before taking another job, and a warmed-up
+replacement is started in its place. A job whose worker dies (e.g. killed
+for running out of memory) is retried on a fresh worker.
+
+Workers report each stage they enter (see stage_clock), and a job that
+overruns its stage's time limit, or WORKER_JOB_TIMEOUT overall, is stopped by
+killing its worker. Cancelling the await of run_in_worker (e.g. because the
+client disconnected) drops a queued job or kills the worker running it.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.config import (
+    CONVERSION_WORKERS,
+    WORKER_MAX_JOBS,
+    WORKER_MAX_RSS_MB,
+    WORKER_CRASH_RETRIES,
+    WORKER_JOB_TIMEOUT,
+    STEP_IMPORT_TIMEOUT,
+    TESSELLATION_TIMEOUT,
+    EXPORT_TIMEOUT
+)
+from app.metrics import (
+    process_uptime,
+    resident_memory,
+    set_stage_listener,
+    STARTUP_SECONDS,
+    WORKER_RSS_BYTES,
+    WORKER_JOBS,
+    WORKER_RECYCLES
+)
+
+_pool = None
+
+# Time limit (seconds) of each worker-side stage, by the stage_clock name
+STAGE_TIMEOUTS = {
+    "step_import": STEP_IMPORT_TIMEOUT,
+    "mesh_load": STEP_IMPORT_TIMEOUT,
+    "tessellation": TESSELLATION_TIMEOUT,
+    "export": EXPORT_TIMEOUT,
+    "lods": EXPORT_TIMEOUT
+}
+
+
+class WorkerCrashedError(RuntimeError):
+    """A worker process died while running a job"""
+
+
+class WorkerTimeoutError(TimeoutError):
+    """A worker job overran a stage's time limit (stage is None for the job limit)"""
+
+    def __init__(self, stage, limit):
+        self.stage = stage
+        self.limit = limit
+        if stage:
+            super().__init__(f"Conversion timed out: stage '{stage}' took longer than {limit} s")
+        else:
+            super().__init__(f"Conversion timed out: took longer than {limit} s")
+
+
+def _init_worker():
+    """Import the CAD stack once per worker so jobs don't pay for it"""
+    from app.converter import warm_up
+    warm_up()
+
+
+def _retire_reason(jobs, rss, max_jobs, max_rss):
+    if max_jobs and jobs >= max_jobs:
+        return "max_jobs"
+    if max_rss and rss >= max_rss:
+        return "max_rss"
+    return None
+
+
+def _worker_main(conn, max_jobs, max_rss):
+    """
+    Worker process loop: receive a job, run it, reply with ("stage", name)
+    as it enters each stage, then ("done", ok, result or exception, rss,
+    retire reason). Exits after replying
+    with a retire reason, or when the pool closes the connection.
+    """
+    _init_worker()
+    set_stage_listener(lambda stage: conn.send(("stage", stage)))
+    conn.send(("ready", resident_memory()))
+    jobs = 0
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except EOFError:
+            return
+
+        try:
+            # Unpickled here so a job that can't be loaded fails on its own
+            job = pickle.loads(data)
+            if job is None:
+                return
+            ok, value = True, job()
+        except Exception as e:
+            ok, value = False, e
+        jobs += 1
+        rss = resident_memory()
+        reason = _retire_reason(jobs, rss, max_jobs, max_rss)
+        try:
+            conn.send(("done", ok, value, rss, reason))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            conn.send(("done", False, RuntimeError(f"Worker result could not be returned: {e}"), rss, reason))
+        if reason:
+            return
+
+
+class _Worker:
+    """One worker process and the pipe to it"""
+
+    def __init__(self, context, max_jobs, max_rss):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, max_jobs, max_rss), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.rss = None
+        self.jobs = 0
+
+    def wait_ready(self):
+        """Block until the worker has imported the CAD stack"""
+        _, self.rss = self.conn.recv()
+
+    def run(self, job, job_timeout=0, stage_timeouts=STAGE_TIMEOUTS):
+        """
+        Run a job and return (ok, result or exception, retire reason).
+        Raises WorkerTimeoutError when a limit passes; the worker is then still busy.
+        """
+        try:
+            self.conn.send(job)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            # Raised while pickling, before anything was sent
+            return False, e, None
+
+        # Pending limits as (deadline, stage, seconds)
+        job_limit = (time.monotonic() + job_timeout, None, job_timeout) if job_timeout else None
+        stage_limit = None
+        while True:
+            limits = [limit for limit in (job_limit, stage_limit) if limit is not None]
+            nearest = min(limits, key=lambda limit: limit[0]) if limits else None
+            wait = max(0.0, nearest[0] - time.monotonic()) if nearest else None
+            if not self.conn.poll(wait):
+                raise WorkerTimeoutError(nearest[1], nearest[2])
+
+            message = self.conn.recv()
+            if message[0] == "stage":
+                seconds = stage_timeouts.get(message[1])
+                stage_limit = (time.monotonic() + seconds, message[1], seconds) if seconds else None
+                continue
+
+            _, ok, value, self.rss, reason = message
+            self.jobs += 1
+            return ok, value, reason
+
+    def kill(self):
+        self.process.kill()
+
+    def stop(self, wait=True):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+        if wait:
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class WorkerPool:
+    """
+    A fixed number of worker slots. Each slot is a thread that owns one worker
+    process at a time and feeds it jobs from a shared queue; results come back
+    as concurrent.futures Futures.
+    """
+
+    def __init__(self, max_workers, max_jobs=WORKER_MAX_JOBS, max_rss_mb=WORKER_MAX_RSS_MB):
+        # spawn rather than fork: the parent has a running event loop and threads
+        self._context = multiprocessing.get_context("spawn")
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self._jobs = queue.Queue()
+        self._workers = [None] * max_workers
+        self._lock = threading.Lock()
+        self._closed = False
+        self._started = time.perf_counter()
+        self._ready = [threading.Event() for _ in range(max_workers)]
+        # The future each slot is running, and whether it was cancelled mid-run
+        self._running = [None] * max_workers
+        self._cancelling = [False] * max_workers
+        self.warmup_seconds = None
+        self._threads = [
+            threading.Thread(target=self._run_slot, args=(slot,), name=f"conversion-worker-{slot}", daemon=True)
+            for slot in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a picklable call; returns a Future for its result"""
+        if self._closed:
+            raise RuntimeError("Worker pool is shut down")
+        future = Future()
+        self._jobs.put((future, functools.partial(fn, *args, **kwargs)))
+        return future
+
+    def cancel(self, future):
+        """Cancel a job: drop it if it is still queued, or kill the worker running it"""
+        if future.cancel():
+            return
+        with self._lock:
+            for slot, running in enumerate(self._running):
+                if running is future and self._workers[slot] is not None:
+                    self._cancelling[slot] = True
+                    self._workers[slot].kill()
+
+    def ready(self):
+        """Whether every slot has had a warm worker"""
+        return all(event.is_set() for event in self._ready)
+
+    def stats(self):
+        """pid, jobs run and last reported RSS of each live worker"""
+        with self._lock:
+            workers = [worker for worker in self._workers if worker is not None]
+        return [
+            {
+                "pid": worker.process.pid,
+                "jobs": worker.jobs,
+                "rssMB": round(worker.rss / 1024 / 1024, 1) if worker.rss is not None else None
+            }
+            for worker in workers
+        ]
+
+    def _start_worker(self, slot):
+        worker = _Worker(self._context, self.max_jobs, self.max_rss)
+        with self._lock:
+            self._workers[slot] = worker
+        try:
+            worker.wait_ready()
+        except (EOFError, OSError):
+            self._retire(slot, "crashed", wait=False)
+            raise WorkerCrashedError("Conversion worker died while starting")
+        WORKER_RSS_BYTES.set(worker.rss, worker=str(slot))
+        if not self._ready[slot].is_set():
+            self._ready[slot].set()
+            self._on_warm()
+        return worker
+
+    def _on_warm(self):
+        if self.warmup_seconds is None and self.ready():
+            # Measured from process start where possible, to compare with the app's own startup time
+            self.warmup_seconds = process_uptime() or time.perf_counter() - self._started
+            STARTUP_SECONDS.set(round(self.warmup_seconds, 3), phase="workers_warm")
+
+    def _retire(self, slot, reason, wait=True):
+        with self._lock:
+            worker, self._workers[slot] = self._workers[slot], None
+        if worker is not None:
+            worker.stop(wait)
+        WORKER_RECYCLES.inc(reason=reason)
+
+    def _run_job(self, slot, job):
+        """Run a job in the slot's worker, starting a fresh one if needed and retrying crashes"""
+        attempt = 0
+        while True:
+            try:
+                worker = self._workers[slot] or self._start_worker(slot)
+                ok, value, reason = worker.run(job, WORKER_JOB_TIMEOUT)
+            except WorkerTimeoutError as e:
+                WORKER_JOBS.inc(outcome="timeout")
+                self._workers[slot].kill()
+                self._retire(slot, "timeout", wait=False)
+                return False, e
+            except (EOFError, OSError, WorkerCrashedError):
+                if self._cancelling[slot]:
+                    WORKER_JOBS.inc(outcome="cancelled")
+                    self._retire(slot, "cancelled", wait=False)
+                    return False, concurrent.futures.CancelledError()
+                WORKER_JOBS.inc(outcome="crashed")
+                if self._workers[slot] is not None:
+                    self._retire(slot, "crashed", wait=False)
+                if self._closed or attempt >= WORKER_CRASH_RETRIES:
+                    return False, WorkerCrashedError("Conversion worker died while processing the file")
+                attempt += 1
+                continue
+
+            WORKER_JOBS.inc(outcome="success" if ok else "error")
+            WORKER_RSS_BYTES.set(worker.rss, worker=str(slot))
+            if reason:
+                self._retire(slot, reason)
+            return ok, value
+
+    def _run_slot(self, slot):
+        try:
+            self._start_worker(slot)
+        except WorkerCrashedError:
+            pass
+
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                break
+            future, job = item
+            with self._lock:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._running[slot] = future
+            try:
+                ok, value = self._run_job(slot, job)
+            except BaseException as e:
+                # Anything else, e.g. a result that can't be unpickled, leaves the
+                # worker's pipe in an unknown state: fail the job and replace it
+                WORKER_JOBS.inc(outcome="error")
+                if self._workers[slot] is not None:
+                    self._workers[slot].kill()
+                    self._retire(slot, "broken", wait=False)
+                ok, value = False, e
+            with self._lock:
+                cancelled, self._cancelling[slot] = self._cancelling[slot], False
+                self._running[slot] = None
+            if cancelled and self._workers[slot] is not None:
+                # Killed just as the job finished: don't reuse the worker
+                self._retire(slot, "cancelled", wait=False)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+            # Warm the replacement of a retired worker before the next job arrives
+            if self._workers[slot] is None and not self._closed:
+                try:
+                    self._start_worker(slot)
+                except WorkerCrashedError:
+                    pass
+
+        with self._lock:
+            worker, self._workers[slot] = self._workers[slot], None
+        if worker is not None:
+            worker.stop(wait=False)
+
+    def shutdown(self):
+        """Stop the workers, dropping any queued jobs"""
+        self._closed = True
+        while True:
+            try:
+                future, _ = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+        for _ in self._threads:
+            self._jobs.put(None)
+
+
+def start_worker_pool(max_workers=CONVERSION_WORKERS):
+    """Create the worker pool; its processes start and import the CAD stack in the background"""
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool(max_workers)
+    return _pool
+
+
+def workers_ready():
+    """
+    Whether the pool is warm: every worker slot has had a process import the
+    CAD stack, so conversions won't wait on a cold start.
+    """
+    return _pool is not None and _pool.ready()
+
+
+def warmup_seconds():
+    """Seconds from process start until the worker pool was warm, or None while it is still warming"""
+    return _pool.warmup_seconds if _pool is not None else None
+
+
+def worker_stats():
+    """Per-worker pid, job count and memory, for readiness output"""
+    return _pool.stats() if _pool is not None else []
+
+
+def shutdown_worker_pool():
+    """Stop the worker pool, dropping any queued jobs"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+async def run_in_worker(fn, *args, **kwargs):
+    """
+    Run a picklable function in the worker pool and await its result.
+    Raises WorkerTimeoutError if the job overruns a time limit. Cancelling
+    the await cancels the job, killing its worker if it has started.
+    """
+    pool = _pool or start_worker_pool()
+    future = pool.submit(fn, *args, **kwargs)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        pool.cancel(future)
+        raise